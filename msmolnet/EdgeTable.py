@@ -0,0 +1,117 @@
+"""Class to hold spectrum matches as a table of edges
+"""
+
+import os
+import numpy
+
+#one row for each match between the spectra at list positions i<j
+EDGE_DTYPE=numpy.dtype([('i',numpy.int64),('j',numpy.int64),('cosine',numpy.float64),('peaks',numpy.int64)])
+
+class EdgeTable:
+    """Spectrum matches stored once each as rows of a NumPy structured array, instead of twice in a nested dictionary.
+    Rows are in the order the matches were scored, which is the order compare_all adds them to its dictionary.
+
+    Parameters:
+    spectra_list -- list of Spectrum objects that the positions i and j refer to
+    edges -- structured array of EDGE_DTYPE rows (i, j, cosine, peaks)
+    """
+
+    def __init__(self,spectra_list,edges=None):
+        self.spectra_list=spectra_list
+        self.edges=numpy.empty(0,dtype=EDGE_DTYPE) if edges is None else edges
+
+    def __len__(self):
+        return len(self.edges)
+
+    @classmethod
+    def from_blocks(cls,spectra_list,blocks):
+        """Takes a list of Spectrum objects and an iterable of scored blocks of pairs (first, second, scores, peak_counts),
+        like those from similarity.score_pairs, and returns an EdgeTable of them"""
+        tables=[numpy.empty(0,dtype=EDGE_DTYPE)]
+        for first,second,scores,peak_counts in blocks:
+            table=numpy.empty(len(first),dtype=EDGE_DTYPE)
+            table['i'],table['j'],table['cosine'],table['peaks']=first,second,scores,peak_counts
+            tables.append(table)
+        return cls(spectra_list,numpy.concatenate(tables))
+
+    @classmethod
+    def from_dict(cls,spectra_list,matches):
+        """Takes a list of Spectrum objects and a nested dictionary of their matches and returns an EdgeTable of them,
+        with the rows sorted by i then j as compare_all scores them"""
+        positions={spectrum:i for i,spectrum in enumerate(spectra_list)}
+        rows=[]
+        for spectrum_one in matches:
+            i=positions[spectrum_one]
+            for spectrum_two,match in matches[spectrum_one].items():
+                j=positions[spectrum_two]
+                if i<j:
+                    rows.append((i,j,match['cosine'],match['peaks']))
+        edges=numpy.array(rows,dtype=EDGE_DTYPE)
+        return cls(spectra_list,edges[numpy.lexsort((edges['j'],edges['i']))])
+
+    @classmethod
+    def from_file(cls,spectra_list,file_path):
+        """Takes a list of Spectrum objects and a file of binary rows written by save or similarity.write_matches, and
+        returns an EdgeTable of them. The rows are memory mapped rather than read into memory"""
+        if os.path.getsize(file_path)==0:
+            return cls(spectra_list)
+        return cls(spectra_list,numpy.memmap(file_path,dtype=EDGE_DTYPE,mode='r'))
+
+    def save(self,file_path):
+        """Writes the rows to a binary file that can be read with from_file
+        """
+        self.edges.tofile(file_path)
+
+    def filter(self,cosine_threshold=0.7,peak_threshold=6):
+        """Returns a new EdgeTable with only the matches that pass the cosine and n peaks thresholds
+        """
+        keep=(self.edges['cosine']>=cosine_threshold)&(self.edges['peaks']>=peak_threshold)
+        return EdgeTable(self.spectra_list,self.edges[keep])
+
+    def iter_edges(self):
+        """Yields each match as (spectrum_one, spectrum_two, {'cosine':..., 'peaks':...}), as used by networkx
+        """
+        spectra_list=self.spectra_list
+        for i,j,score,peak_count in zip(self.edges['i'].tolist(),self.edges['j'].tolist(),self.edges['cosine'].tolist(),
+                self.edges['peaks'].tolist()):
+            yield spectra_list[i],spectra_list[j],{'cosine':score,'peaks':peak_count}
+
+    def network_nodes(self):
+        """Returns a list of the spectra with matches, in the order they are keys of to_dict()
+        """
+        nodes=numpy.column_stack((self.edges['i'],self.edges['j'])).ravel()
+        values,first_seen=numpy.unique(nodes,return_index=True)
+        return [self.spectra_list[i] for i in values[numpy.argsort(first_seen)].tolist()]
+
+    def network_edges(self):
+        """Yields each match as (spectrum_one, spectrum_two, {'cosine':..., 'peaks':...}) in the order networkx adds the
+        edges when making a graph from to_dict(), so the graph has the same order of neighbours for each node"""
+        #each row is found under both spectra; the dictionary has spectra in the order they first appear
+        nodes=numpy.column_stack((self.edges['i'],self.edges['j'])).ravel()
+        partners=numpy.column_stack((self.edges['j'],self.edges['i'])).ravel()
+        rows=numpy.repeat(numpy.arange(len(self.edges)),2)
+
+        values,first_seen=numpy.unique(nodes,return_index=True)
+        order=numpy.argsort(first_seen[numpy.searchsorted(values,nodes)],kind='stable')
+        #networkx only uses the first time each edge is found
+        _,first_found=numpy.unique(rows[order],return_index=True)
+        order=order[numpy.sort(first_found)]
+
+        spectra_list=self.spectra_list
+        for node,partner,row in zip(nodes[order].tolist(),partners[order].tolist(),rows[order].tolist()):
+            yield spectra_list[node],spectra_list[partner],{'cosine':self.edges['cosine'][row].item(),
+                'peaks':self.edges['peaks'][row].item()}
+
+    def to_dict(self):
+        """Returns the matches as the nested dictionary made by compare_all, with each match under both spectra
+        """
+        matches={}
+        for spectrum_one,spectrum_two,match in self.iter_edges():
+            if spectrum_one not in matches:
+                matches[spectrum_one]={}
+            matches[spectrum_one][spectrum_two]=match
+
+            if spectrum_two not in matches:
+                matches[spectrum_two]={}
+            matches[spectrum_two][spectrum_one]=dict(match)
+        return matches
@@ -0,0 +1,133 @@
+"""Class to look up single spectra in an mgf file without parsing the whole file
+"""
+
+import locale
+import numpy
+from msmolnet import mgf_cache
+from msmolnet import read_mgf as mgf
+
+#increase if the layout of the index file changes so old index files are rebuilt
+INDEX_VERSION=1
+
+class MgfIndex:
+    """Index of the byte position of every spectrum in an mgf file, by scans number and by precursor mass.
+    The index is saved to a file next to the mgf file and only rebuilt when the mgf file changes.
+
+    Parameters:
+    file_path -- path to the mgf file
+    starts, ends -- byte range of each spectrum in the file, in file order
+    scans -- feature ID of each spectrum ('' if it has none)
+    pep_mass -- precursor mass of each spectrum (NaN if it has none)
+    order -- positions of the spectra sorted by precursor mass
+    """
+
+    def __init__(self,file_path,save=True):
+        self.file_path=file_path
+
+        if not self._load():
+            self._build()
+            if save:
+                self._save()
+
+        self.sorted_pep_mass=self.pep_mass[self.order]
+        self.positions={}
+        for i,scans in enumerate(self.scans.tolist()):
+            self.positions.setdefault(scans,i)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get(self,scans):
+        """Takes a scans number and returns the Spectrum object with that feature ID, or None if it is not in the file
+        """
+        i=self.positions.get(str(scans))
+        if i is None or str(scans)=='':
+            return None
+        return self._read(i)
+
+    def range(self,pepmass_lo,pepmass_hi):
+        """Returns a list of the Spectrum objects with precursor mass between the two values (inclusive), sorted by precursor mass
+        """
+        lo=numpy.searchsorted(self.sorted_pep_mass,pepmass_lo,side='left')
+        hi=numpy.searchsorted(self.sorted_pep_mass,pepmass_hi,side='right')
+        return [self._read(i) for i in self.order[lo:hi].tolist()]
+
+    def index_path(self):
+        """Path of the index file saved next to the mgf file
+        """
+        return f"{self.file_path}.msmolnet-index.npz"
+
+    def _read(self,i):
+        """Parse the spectrum at position i of the file
+        """
+        return mgf.read_range(self.file_path,int(self.starts[i]),int(self.ends[i]))[0]
+
+    def _build(self):
+        """Scan the mgf file for the byte range, scans number and precursor mass of every spectrum.
+        Peak lines are skipped without being parsed.
+        """
+        encoding=locale.getpreferredencoding(False)
+        starts=[]
+        ends=[]
+        scans=[]
+        pep_mass=[]
+
+        start=None
+        position=0
+        with open(self.file_path,'rb') as file:
+            for line in file:
+                line_start=position
+                position+=len(line)
+
+                if b'BEGIN IONS' in line:
+                    start=line_start
+                    parameters={}
+                    continue
+
+                if start is None:
+                    continue
+
+                if b'END IONS' in line:
+                    starts.append(start)
+                    ends.append(position)
+                    #same precedence as Spectrum.set_id
+                    scans.append(parameters.get('scans',parameters.get('SCANS','')))
+                    pep_mass.append(parameters.get('pepmass',numpy.nan))
+                    start=None
+
+                elif b'=' in line:
+                    parameter,value=line.decode(encoding).rstrip('\r\n').split('=',1)
+                    if parameter in ('SCANS','scans'):
+                        parameters[parameter]=value
+                    if "pepmass".casefold() in parameter.casefold():
+                        parameters['pepmass']=float(value)
+
+        self.starts=numpy.array(starts,dtype=numpy.int64)
+        self.ends=numpy.array(ends,dtype=numpy.int64)
+        self.scans=numpy.array(scans,dtype=str)
+        self.pep_mass=numpy.array(pep_mass,dtype=numpy.float64)
+        #spectra without a precursor mass are sorted to the end
+        self.order=numpy.argsort(self.pep_mass,kind='stable')
+
+    def _save(self):
+        """Save the index next to the mgf file. The index is still usable if it can't be saved.
+        """
+        try:
+            with open(self.index_path(),'wb') as f:
+                numpy.savez(f,version=INDEX_VERSION,source=mgf_cache.file_stamp(self.file_path),starts=self.starts,
+                    ends=self.ends,scans=self.scans,pep_mass=self.pep_mass,order=self.order)
+        except OSError:
+            pass
+
+    def _load(self):
+        """Load a saved index if there is one that matches the mgf file
+        """
+        try:
+            with numpy.load(self.index_path()) as saved:
+                if saved['version']!=INDEX_VERSION or saved['source'].tolist()!=mgf_cache.file_stamp(self.file_path):
+                    return False
+                for name in ('starts','ends','scans','pep_mass','order'):
+                    setattr(self,name,saved[name])
+        except (OSError,ValueError,KeyError):
+            return False
+        return True
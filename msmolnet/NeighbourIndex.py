@@ -0,0 +1,160 @@
+"""Class to find approximate nearest neighbours of spectra without scoring every pair
+"""
+
+import numpy
+from msmolnet import similarity
+
+#number of random hyperplanes hashed together to make each table's bucket code
+HASH_BITS=8
+
+class NeighbourIndex:
+    """Random projection locality sensitive hashing index of binned spectra, restricted by precursor window.
+    Each table hashes every spectrum to the signs of its binned vector projected onto random hyperplanes, so spectra
+    with a high cosine usually share a bucket in at least one table. Pairs sharing a bucket with precursor masses within
+    precursor_tolerance are candidates, and each spectrum keeps its candidates with the highest binned approximate cosine.
+    More tables, fewer bits and a larger oversample find more of the true neighbours (higher recall) but give more pairs
+    to score.
+
+    Parameters:
+    spectra_list -- list of Spectrum objects the index was built from
+    fragment_tolerance -- m/z bin width of the binned spectra
+    precursor_tolerance -- maximum precursor mass difference of candidate pairs
+    n_tables -- number of hash tables
+    n_bits -- number of random hyperplanes in each table
+    max_partners -- maximum number of candidates taken from a bucket for each spectrum, nearest precursor mass first
+    codes -- bucket code of each spectrum in each table (spectra by tables)
+    """
+
+    def __init__(self,spectra_list,fragment_tolerance=0.3,precursor_tolerance=1.0,n_tables=32,n_bits=HASH_BITS,max_partners=200,seed=0):
+        self.spectra_list=spectra_list
+        self.fragment_tolerance=fragment_tolerance
+        self.precursor_tolerance=precursor_tolerance
+        self.n_tables=n_tables
+        self.n_bits=n_bits
+        self.max_partners=max_partners
+        self.seed=seed
+
+        bin_width=fragment_tolerance+similarity.SEARCH_SLACK
+        self.vectors=similarity.binned_vectors(spectra_list,bin_width)
+        #peaks spread into the neighbouring bins, so peaks either side of a bin edge still meet
+        self.spread=similarity.binned_vectors(spectra_list,bin_width,spread=True)
+        self.pep_mass=numpy.array([S.pep_mass for S in spectra_list],dtype=numpy.float64)
+        #spectra without peaks can't match anything and would all share one bucket
+        self.has_peaks=numpy.diff(self.vectors.indptr)>0
+
+        rng=numpy.random.default_rng(seed)
+        planes=rng.standard_normal((self.spread.shape[1],n_tables*n_bits))
+        weights=numpy.left_shift(1,numpy.arange(n_bits,dtype=numpy.int64))
+        #projections are made a block of spectra at a time, so only the bucket codes of all the spectra are kept
+        self.codes=numpy.empty((len(spectra_list),n_tables),dtype=numpy.int64)
+        for start in range(0,len(spectra_list),similarity.ROWS_PER_BLOCK):
+            block=slice(start,start+similarity.ROWS_PER_BLOCK)
+            bits=(self.spread[block]@planes)>0
+            self.codes[block]=bits.reshape(-1,n_tables,n_bits)@weights
+
+    def __len__(self):
+        return len(self.spectra_list)
+
+    def candidate_pairs(self,k,oversample=4):
+        """Takes the number of neighbours wanted for each spectrum and returns the candidate pairs as two arrays of list
+        positions (first, second) with first<second, sorted by first then second.
+        Each spectrum keeps its k*oversample candidates with the highest binned approximate cosine, and a pair is kept if
+        either spectrum keeps it. Pass the pairs to similarity.compare_all to score them exactly"""
+        first,second=self._bucket_pairs()
+        if len(first)==0:
+            return first,second
+
+        scores=self.approximate_cosines(first,second)
+
+        #rank the candidates of each spectrum by approximate cosine, ties in pair order
+        nodes=numpy.concatenate((first,second))
+        pair_numbers=numpy.tile(numpy.arange(len(first)),2)
+        order=numpy.lexsort((-numpy.tile(scores,2),nodes))
+        sorted_nodes=nodes[order]
+        rank=numpy.arange(len(nodes))-numpy.searchsorted(sorted_nodes,sorted_nodes,side='left')
+
+        keep=numpy.zeros(len(first),dtype=bool)
+        keep[pair_numbers[order][rank<k*oversample]]=True
+        return first[keep],second[keep]
+
+    def neighbours(self,k,oversample=4):
+        """Takes the number of neighbours wanted for each spectrum and returns a list with an array of the list positions
+        of the candidate neighbours of each spectrum"""
+        first,second=self.candidate_pairs(k,oversample)
+        nodes=numpy.concatenate((first,second))
+        partners=numpy.concatenate((second,first))
+        order=numpy.lexsort((partners,nodes))
+        bounds=numpy.searchsorted(nodes[order],numpy.arange(len(self)+1))
+        return numpy.split(partners[order],bounds[1:-1])
+
+    def approximate_cosines(self,first,second):
+        """Takes two arrays of list positions and returns the binned approximate cosine of each pair
+        (see similarity.prefilter_pairs)"""
+        return similarity.approximate_cosines(self.vectors,self.spread,first,second)
+
+    def recall_report(self,k,sample_size=1000,oversample=4,modified=False,greedy=False,cosine_threshold=None,peak_threshold=None):
+        """Compares the k best neighbours of each spectrum found from the candidate pairs with those found by exact
+        compare_all, on a random sample of the spectra indexed with the same settings.
+        returns a dictionary with the recall (fraction of the exact neighbours found), the number of exact neighbour
+        pairs, the number of them found, and the number of candidate pairs scored out of the pairs in precursor windows"""
+        rng=numpy.random.default_rng(self.seed)
+        sample=numpy.sort(rng.choice(len(self),min(sample_size,len(self)),replace=False))
+        sample_list=[self.spectra_list[i] for i in sample.tolist()]
+        options={'fragment_tolerance':self.fragment_tolerance,'modified':modified,'precursor_tolerance':self.precursor_tolerance,
+            'greedy':greedy,'cosine_threshold':cosine_threshold,'peak_threshold':peak_threshold}
+
+        exact=top_neighbours(similarity.compare_all(sample_list,**options),k)
+
+        index=NeighbourIndex(sample_list,self.fragment_tolerance,self.precursor_tolerance,self.n_tables,self.n_bits,
+            self.max_partners,self.seed)
+        pairs=index.candidate_pairs(k,oversample)
+        approximate=top_neighbours(similarity.compare_all(sample_list,pairs=pairs,**options),k)
+
+        window_pairs=sum(len(first) for first,second in similarity.candidate_pairs(sample_list,self.precursor_tolerance))
+        found=len(exact&approximate)
+        return {'recall':found/len(exact) if exact else 1.0,'exact_pairs':len(exact),'found_pairs':found,
+            'candidate_pairs':len(pairs[0]),'window_pairs':window_pairs}
+
+    def _bucket_pairs(self):
+        """Pairs of list positions (first<second) that share a bucket in any table and have precursor masses within
+        precursor_tolerance, sorted by first then second"""
+        n=len(self)
+        tolerance=self.precursor_tolerance+similarity.SEARCH_SLACK
+        valid=numpy.flatnonzero(self.has_peaks)
+        #gap between buckets, so a precursor window never reaches into the next bucket
+        span=numpy.ptp(self.pep_mass[valid])+2*tolerance+1 if len(valid) else 1.0
+
+        all_first=[]
+        all_second=[]
+        for table in range(self.n_tables):
+            codes=self.codes[valid,table]
+            order=valid[numpy.lexsort((self.pep_mass[valid],codes))]
+            sorted_codes=self.codes[order,table]
+            sorted_mass=self.pep_mass[order]
+
+            bucket=numpy.concatenate(([0],numpy.cumsum(sorted_codes[1:]!=sorted_codes[:-1])))
+            key=bucket*span+sorted_mass
+            positions=numpy.arange(len(order))
+            hi=numpy.searchsorted(key,key+tolerance,side='right')
+            hi=numpy.minimum(hi,positions+1+self.max_partners)
+
+            counts=hi-positions-1
+            first=numpy.repeat(positions,counts)
+            second=first+1+numpy.arange(len(first))-numpy.repeat(numpy.cumsum(counts)-counts,counts)
+            keep=(sorted_codes[first]==sorted_codes[second])&(numpy.abs(sorted_mass[second]-sorted_mass[first])<=self.precursor_tolerance)
+            first,second=order[first[keep]],order[second[keep]]
+            all_first.append(numpy.minimum(first,second))
+            all_second.append(numpy.maximum(first,second))
+
+        pair_keys=numpy.unique(numpy.concatenate(all_first+[numpy.empty(0,dtype=numpy.int64)])*n
+            +numpy.concatenate(all_second+[numpy.empty(0,dtype=numpy.int64)]))
+        return pair_keys//n,pair_keys%n
+
+def top_neighbours(matches,k):
+    """Takes a nested dictionary of spectrum matches and returns the set of pairs of spectra (as frozensets) where one
+    spectrum is among the k highest cosine matches of the other"""
+    pairs=set()
+    for spectrum,partners in matches.items():
+        best=sorted(partners.items(),key=lambda item: item[1]['cosine'],reverse=True)[:k]
+        pairs.update(frozenset((spectrum,partner)) for partner,match in best)
+    return pairs
@@ -5,6 +5,7 @@ import math
 
 class Peak:
     """Class to hold an MS2 peak.
+    Spectrum objects store their peaks as arrays; Peak objects are only made when Spectrum.peaks is used.
 
     Parameters:
     mass
@@ -13,10 +14,12 @@ class Peak:
     scaled_intensity (after using Spectrum.euclidean_scale method) -- intensities in a spectrum are scaled to Euclidean norm 1
     """
 
+    __slots__=('mass','intensity','sqrt_intensity','scaled_intensity')
+
     def __init__(self,mass,intensity):
         self.mass = mass
         self.intensity = intensity
         self.sqrt_intensity = math.sqrt(self.intensity)
-    
+
     def __repr__(self):
-        return f"{self.__class__.__name__}({self.mass},{self.intensity})"
\ No newline at end of file
+        return f"{self.__class__.__name__}({self.mass},{self.intensity})"
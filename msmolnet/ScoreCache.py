@@ -0,0 +1,84 @@
+"""Class to keep the scores of spectrum pairs between runs, so pairs that were already scored are not scored again
+"""
+
+import hashlib
+import sqlite3
+import numpy
+
+#increase if the scoring methods change so scores saved by older versions are not used
+SCORE_VERSION=2
+
+class ScoreCache:
+    """SQLite store of spectrum pair scores, keyed by a hash of each spectrum's peaks and precursor mass (see spectrum_hash)
+    and by the scoring parameters. A spectrum read again from a changed file has the same key as long as its peaks and
+    precursor mass are the same, wherever it is in the list.
+    Pairs are stored in the order they were scored (first, second); the same pair the other way round is scored again.
+    The exact score of every pair is stored, and pairs without a match (no matching peaks) with 0 cosine and 0 peaks, so
+    the same scores can be used with any cosine and peak thresholds.
+
+    Parameters:
+    file_path -- path to the SQLite database file, created if it doesn't exist
+    """
+
+    def __init__(self,file_path):
+        self.file_path=file_path
+        self.connection=sqlite3.connect(file_path)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS scores (first BLOB, second BLOB, parameters TEXT, cosine REAL,
+            peaks INTEGER, PRIMARY KEY (first, second, parameters)) WITHOUT ROWID''')
+        self.connection.execute('CREATE TEMP TABLE query (position INTEGER, first BLOB, second BLOB)')
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        self.close()
+
+    def lookup(self,hashes,first,second,parameters):
+        """Takes a list of spectrum hashes, two arrays of positions in that list and a parameter key (see parameter_key).
+        Returns arrays of the cosine score, number of peaks, and whether the pair was found, for each pair"""
+        cosine=numpy.zeros(len(first))
+        peaks=numpy.zeros(len(first),dtype=numpy.int64)
+        found=numpy.zeros(len(first),dtype=bool)
+
+        self.connection.execute('DELETE FROM query')
+        self.connection.executemany('INSERT INTO query VALUES (?,?,?)',
+            ((k,hashes[i],hashes[j]) for k,(i,j) in enumerate(zip(first.tolist(),second.tolist()))))
+        rows=self.connection.execute('''SELECT query.position, scores.cosine, scores.peaks FROM query JOIN scores
+            ON scores.first=query.first AND scores.second=query.second AND scores.parameters=?''',(parameters,)).fetchall()
+
+        if rows:
+            positions,row_cosine,row_peaks=zip(*rows)
+            positions=numpy.array(positions)
+            cosine[positions]=row_cosine
+            peaks[positions]=row_peaks
+            found[positions]=True
+        return cosine,peaks,found
+
+    def store(self,hashes,first,second,cosine,peaks,parameters):
+        """Takes a list of spectrum hashes, two arrays of positions in that list, the cosine score and number of peaks of each
+        pair, and a parameter key (see parameter_key), and saves the scores"""
+        self.connection.executemany('INSERT OR REPLACE INTO scores VALUES (?,?,?,?,?)',
+            ((hashes[i],hashes[j],parameters,score,peak_count) for i,j,score,peak_count
+                in zip(first.tolist(),second.tolist(),cosine.tolist(),peaks.tolist())))
+        self.connection.commit()
+
+def spectrum_hash(spectrum):
+    """Takes a Spectrum object and returns a hash of its peak m/z values, scaled intensities and precursor mass
+    """
+    digest=hashlib.blake2b(digest_size=16)
+    digest.update(numpy.ascontiguousarray(spectrum.mz,dtype=numpy.float64).tobytes())
+    digest.update(numpy.ascontiguousarray(spectrum.scaled_intensity,dtype=numpy.float64).tobytes())
+    digest.update(numpy.float64(getattr(spectrum,'pep_mass',numpy.nan)).tobytes())
+    return digest.digest()
+
+def parameter_key(fragment_tolerance,modified,precursor_tolerance,greedy):
+    """Takes the parameters that change the scores and returns the text they are stored under. The thresholds are not part
+    of the key, as they are applied to the stored scores after they are looked up"""
+    return repr((SCORE_VERSION,float(fragment_tolerance),bool(modified),float(precursor_tolerance),bool(greedy)))
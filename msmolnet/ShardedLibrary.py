@@ -0,0 +1,117 @@
+"""Class to search a library too large to hold in memory, split into shards by precursor mass
+"""
+
+import os
+from collections import OrderedDict
+import numpy
+from msmolnet import mgf_cache
+from msmolnet import read_mgf as mgf
+from msmolnet.MgfIndex import MgfIndex
+from msmolnet.SpectralLibrary import SpectralLibrary, library_arrays, BIN_WIDTH
+
+#increase if the layout of the manifest changes so old shards are rebuilt
+SHARDS_VERSION=1
+
+#number of library spectra in each shard
+SHARD_SIZE=100000
+
+#number of shards kept memory mapped at once
+OPEN_SHARDS=8
+
+class ShardedLibrary:
+    """Library spectra split into shards of consecutive precursor masses, each saved as a SpectralLibrary directory.
+    A manifest lists the precursor mass range of each shard. Shards are memory mapped when a search needs them, and the
+    least recently used shard is closed when more than max_open are mapped.
+    The shards are built from the mgf file once, reading shard_size spectra at a time (see MgfIndex), and rebuilt when
+    the mgf file changes, unless build is False. Library spectra without a precursor mass are left out.
+
+    Parameters:
+    file_path -- path to the library mgf file
+    shard_size -- number of library spectra in each shard
+    max_open -- maximum number of shards memory mapped at once
+    pepmass_lo, pepmass_hi -- arrays of the lowest and highest precursor mass in each shard
+    sizes -- array of the number of spectra in each shard
+    """
+
+    def __init__(self,file_path,shard_size=SHARD_SIZE,max_open=OPEN_SHARDS,bin_width=BIN_WIDTH,build=True):
+        self.file_path=file_path
+        self.shard_size=shard_size
+        self.max_open=max_open
+        self._open=OrderedDict()
+
+        manifest=self._load_manifest()
+        if manifest is None or manifest['shard_size']!=shard_size or manifest['bin_width']!=bin_width:
+            if not build:
+                raise OSError(f"Library shards in {self.library_path()} are missing or out of date")
+            manifest=self._build(bin_width)
+
+        self.pepmass_lo=numpy.array([shard['pepmass_lo'] for shard in manifest['shards']],dtype=numpy.float64)
+        self.pepmass_hi=numpy.array([shard['pepmass_hi'] for shard in manifest['shards']],dtype=numpy.float64)
+        self.sizes=numpy.array([shard['size'] for shard in manifest['shards']],dtype=numpy.int64)
+
+    def __len__(self):
+        return int(self.sizes.sum())
+
+    def library_path(self):
+        """Path of the directory of shards saved next to the mgf file
+        """
+        return f"{self.file_path}.msmolnet-shards"
+
+    def shard(self,k):
+        """Returns shard k as a memory mapped SpectralLibrary, closing the least recently used shard if too many are open
+        """
+        if k in self._open:
+            self._open.move_to_end(k)
+            return self._open[k]
+
+        library=SpectralLibrary.from_directory(self._shard_path(k),self.file_path)
+        if library is None:
+            raise OSError(f"Library shard {self._shard_path(k)} is missing or out of date")
+        self._open[k]=library
+        while len(self._open)>self.max_open:
+            self._open.popitem(last=False)
+        return library
+
+    def libraries(self,pepmass_lo,pepmass_hi):
+        """Returns a list of the shards, as SpectralLibrary objects in order of precursor mass, that have spectra with
+        precursor masses between the two values (inclusive). Other shards are not opened"""
+        overlapping=numpy.flatnonzero((self.pepmass_lo<=pepmass_hi)&(self.pepmass_hi>=pepmass_lo))
+        return [self.shard(k) for k in overlapping.tolist()]
+
+    def _shard_path(self,k):
+        return os.path.join(self.library_path(),f"shard{k}")
+
+    def _build(self,bin_width):
+        """Split the library mgf file into shards by precursor mass and save them with the manifest
+        """
+        index=MgfIndex(self.file_path)
+        #spectra without a precursor mass are sorted to the end of the index order
+        order=index.order[:numpy.count_nonzero(~numpy.isnan(index.pep_mass))]
+
+        shards=[]
+        for k,start in enumerate(range(0,len(order),self.shard_size)):
+            #read the shard's spectra in file order
+            positions=numpy.sort(order[start:start+self.shard_size])
+            ranges=zip(index.starts[positions].tolist(),index.ends[positions].tolist())
+            library=mgf.read_ranges(self.file_path,list(ranges))
+
+            arrays,metadata=library_arrays(library,bin_width,self.file_path)
+            if not mgf_cache.save_arrays(self._shard_path(k),arrays,metadata):
+                raise OSError(f"Could not write library shard {self._shard_path(k)}")
+            shards.append({'pepmass_lo':float(arrays['pep_mass'][0]),'pepmass_hi':float(arrays['pep_mass'][-1]),
+                'size':len(library)})
+
+        #manifest is written last so an interrupted build is started again
+        manifest={'version':SHARDS_VERSION,'source':mgf_cache.file_stamp(self.file_path),'shard_size':self.shard_size,
+            'bin_width':bin_width,'shards':shards}
+        if not mgf_cache.save_arrays(self.library_path(),{},manifest):
+            raise OSError(f"Could not write library manifest in {self.library_path()}")
+        return manifest
+
+    def _load_manifest(self):
+        """Load the manifest (the metadata.json of the shards directory) if there is one that matches the mgf file
+        """
+        loaded=mgf_cache.load_arrays(self.library_path(),(),SHARDS_VERSION,self.file_path)
+        if loaded is None:
+            return None
+        return loaded[1]
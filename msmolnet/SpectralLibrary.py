@@ -0,0 +1,189 @@
+"""Class to search a library of spectra by precursor mass and fragment peaks without reading the library mgf file each time
+"""
+
+import math
+import numpy
+from msmolnet import mgf_cache
+from msmolnet import read_mgf as mgf
+from msmolnet.Spectrum import Spectrum
+
+#increase if the layout of the library files changes so old libraries are rebuilt
+LIBRARY_VERSION=2
+
+#width of the fragment m/z bins of the inverted index
+BIN_WIDTH=1.0
+
+#number of library spectra with the most shared and shifted fragments scored exactly in an analog search
+ANALOG_CANDIDATES=50
+
+ARRAYS=mgf_cache.ARRAYS+('bin_offsets','bin_spectra','loss_offsets','loss_spectra')
+
+class SpectralLibrary:
+    """Library spectra sorted by precursor mass, with inverted indexes from fragment m/z bins, and from neutral loss bins
+    (precursor mass minus fragment m/z), to the spectra with a peak in each bin. The library is built from the mgf file once, saved to a directory next to it and memory mapped after
+    that; it is rebuilt when the mgf file changes. Use save=False to not write the directory, and load=False to build the
+    library from the mgf file even if the directory exists. Library spectra without a precursor mass are left out.
+
+    Parameters:
+    file_path -- path to the library mgf file
+    pep_mass -- precursor mass of each library spectrum, sorted in ascending order
+    parameters -- metadata of each library spectrum
+    bin_width -- m/z width of the fragment bins
+    bin_offsets, bin_spectra -- the positions of the library spectra with a peak in bin b are
+                                bin_spectra[bin_offsets[b]:bin_offsets[b+1]], in ascending order
+    loss_offsets, loss_spectra -- the same for neutral loss bins; peaks above the precursor mass are left out
+    """
+
+    def __init__(self,file_path,bin_width=BIN_WIDTH,save=True,load=True):
+        self.file_path=file_path
+
+        loaded=mgf_cache.load_arrays(self.library_path(),ARRAYS,LIBRARY_VERSION,file_path) if load else None
+        if loaded is None or loaded[1]['bin_width']!=bin_width:
+            library=[S for S in mgf.read_mgf(file_path,cache=False) if getattr(S,'pep_mass',None) is not None]
+            arrays,metadata=library_arrays(library,bin_width,file_path)
+            if save:
+                mgf_cache.save_arrays(self.library_path(),arrays,metadata)
+        else:
+            arrays,metadata=loaded
+
+        self._set_arrays(arrays,metadata)
+
+    @classmethod
+    def from_directory(cls,directory,file_path):
+        """Takes a directory written with library_arrays and mgf_cache.save_arrays and the mgf file it was made from, and
+        returns the SpectralLibrary memory mapped from it, or None if it doesn't match the mgf file"""
+        loaded=mgf_cache.load_arrays(directory,ARRAYS,LIBRARY_VERSION,file_path)
+        if loaded is None:
+            return None
+        library=cls.__new__(cls)
+        library.file_path=file_path
+        library._set_arrays(*loaded)
+        return library
+
+    def save(self,directory):
+        """Save the library to a directory that from_directory can memory map it from.
+        Returns False if the files could not be written"""
+        return mgf_cache.save_arrays(directory,{name:getattr(self,name) for name in ARRAYS},self.metadata)
+
+    def __len__(self):
+        return len(self.pep_mass)
+
+    def __getitem__(self,i):
+        """Returns the library spectrum at position i as a Spectrum object, with peak arrays that are views of the library
+        """
+        start,end=int(self.offsets[i]),int(self.offsets[i+1])
+        spectrum=Spectrum()
+        spectrum.set_peaks(self.mz[start:end],self.intensity[start:end],self.scaled_intensity[start:end])
+        spectrum.pep_mass=float(self.pep_mass[i])
+        spectrum.parameters=self.parameters[i]
+        spectrum.set_id()
+        return spectrum
+
+    def library_path(self):
+        """Path of the library directory saved next to the mgf file
+        """
+        return f"{self.file_path}.msmolnet-library"
+
+    def libraries(self,pepmass_lo,pepmass_hi):
+        """Returns a list of the SpectralLibrary objects to search for precursor masses between the two values, for
+        searching a SpectralLibrary and a ShardedLibrary the same way"""
+        return [self]
+
+    def range(self,pepmass_lo,pepmass_hi):
+        """Returns the start and end positions of the library spectra with precursor mass between the two values (inclusive)
+        """
+        lo=int(numpy.searchsorted(self.pep_mass,pepmass_lo,side='left'))
+        hi=int(numpy.searchsorted(self.pep_mass,pepmass_hi,side='right'))
+        return lo,hi
+
+    def candidates(self,spectrum,precursor_tolerance=1.0,fragment_tolerance=0.3,n_peaks=1):
+        """Takes a Spectrum object and returns an array of the positions of the library spectra with precursor mass within
+        precursor_tolerance that could have at least n_peaks peaks matching it within fragment_tolerance.
+        For each library spectrum, the query peaks with a library peak in a bin within fragment_tolerance are counted with the
+        inverted index; this is never less than the number of matching peaks, so no library spectrum that could match is left out"""
+        pep_mass=getattr(spectrum,'pep_mass',numpy.nan)
+        lo,hi=self.range(pep_mass-precursor_tolerance,pep_mass+precursor_tolerance)
+        if lo>=hi or n_peaks<=0:
+            return numpy.arange(lo,hi)
+
+        found=self._postings(self.bin_offsets,self.bin_spectra,spectrum.mz,fragment_tolerance,lo,hi)
+        counts=numpy.bincount(numpy.concatenate(found)-lo,minlength=hi-lo)
+        return numpy.flatnonzero(counts>=n_peaks)+lo
+
+    def analog_candidates(self,spectrum,max_mass_difference=None,fragment_tolerance=0.3,n_peaks=1,n_candidates=ANALOG_CANDIDATES):
+        """Takes a Spectrum object and returns an array of the positions (in ascending order) of the library spectra most
+        likely to match it with modified cosine, with precursor mass within max_mass_difference (or any precursor mass).
+        For each library spectrum, the query peaks with a library peak in a fragment bin within fragment_tolerance (shared
+        fragments) or in a neutral loss bin within fragment_tolerance (shifted fragments) are counted with the inverted
+        indexes. The n_candidates library spectra with the highest counts, of at least n_peaks, are returned"""
+        pep_mass=getattr(spectrum,'pep_mass',numpy.nan)
+        if max_mass_difference is None:
+            lo,hi=0,len(self)
+        else:
+            lo,hi=self.range(pep_mass-max_mass_difference,pep_mass+max_mass_difference)
+        if lo>=hi:
+            return numpy.empty(0,dtype=numpy.int64)
+
+        shared=self._postings(self.bin_offsets,self.bin_spectra,spectrum.mz,fragment_tolerance,lo,hi)
+        shifted=self._postings(self.loss_offsets,self.loss_spectra,pep_mass-spectrum.mz,fragment_tolerance,lo,hi)
+        #each query peak counts once for each library spectrum, matched either way
+        either=[numpy.union1d(direct,loss) for direct,loss in zip(shared,shifted)]
+        counts=numpy.bincount(numpy.concatenate(either)-lo,minlength=hi-lo)
+        shared_counts=numpy.bincount(numpy.concatenate(shared)-lo,minlength=hi-lo)
+
+        #most peaks first, then most shared fragments, then library order
+        order=numpy.lexsort((-shared_counts,-counts))
+        order=order[counts[order]>=max(n_peaks,1)][:n_candidates]
+        return numpy.sort(order)+lo
+
+    def _postings(self,offsets,spectra,masses,fragment_tolerance,lo,hi):
+        """Takes the offsets and spectra of an inverted index and an array of query masses, and returns a list with an
+        array for each mass of the library positions between lo and hi with an entry in a bin within fragment_tolerance"""
+        #bins a matching library peak could be in, for each query peak
+        reach=math.ceil(fragment_tolerance/self.bin_width)
+        query_bins=numpy.floor(numpy.asarray(masses)/self.bin_width).astype(numpy.int64)
+        n_bins=len(offsets)-1
+
+        found=[numpy.empty(0,dtype=numpy.int64)]
+        for query_bin in query_bins.tolist():
+            postings=[numpy.empty(0,dtype=numpy.int64)]
+            for b in range(max(query_bin-reach,0),min(query_bin+reach+1,n_bins)):
+                entries=spectra[offsets[b]:offsets[b+1]]
+                postings.append(entries[numpy.searchsorted(entries,lo):numpy.searchsorted(entries,hi)])
+            found.append(numpy.unique(numpy.concatenate(postings)))
+        return found
+
+    def _set_arrays(self,arrays,metadata):
+        for name in ARRAYS:
+            setattr(self,name,arrays[name])
+        self.metadata=metadata
+        self.parameters=metadata['parameters']
+        self.bin_width=metadata['bin_width']
+
+def library_arrays(library,bin_width,file_path):
+    """Takes a list of library Spectrum objects with precursor masses, the fragment bin width and the mgf file they were
+    read from, and returns the arrays and metadata of a SpectralLibrary: the spectra sorted by precursor mass and the
+    fragment and neutral loss bin indexes"""
+    library=sorted(library,key=lambda S: S.pep_mass)
+    packed=mgf_cache.pack_spectra(library)
+
+    spectra=numpy.repeat(numpy.arange(len(library)),numpy.diff(packed['offsets']))
+    losses=numpy.repeat(packed['pep_mass'],numpy.diff(packed['offsets']))-packed['mz']
+
+    arrays={name:packed[name] for name in mgf_cache.ARRAYS}
+    arrays['bin_offsets'],arrays['bin_spectra']=_inverted_index(packed['mz'],spectra,bin_width)
+    above=losses<0
+    arrays['loss_offsets'],arrays['loss_spectra']=_inverted_index(losses[~above],spectra[~above],bin_width)
+    metadata={'version':LIBRARY_VERSION,'source':mgf_cache.file_stamp(file_path),'bin_width':bin_width,
+        'parameters':packed['parameters']}
+    return arrays,metadata
+
+def _inverted_index(masses,spectra,bin_width):
+    """Takes arrays of peak masses and the library position of each peak, and returns the offsets and spectra of an
+    inverted index with one entry for each spectrum with a peak in a bin, sorted by bin then spectrum"""
+    bins=numpy.floor(masses/bin_width).astype(numpy.int64)
+    entries=numpy.unique(numpy.column_stack((bins,spectra)),axis=0) if len(bins) else numpy.empty((0,2),dtype=numpy.int64)
+    n_bins=int(entries[:,0].max())+1 if len(entries) else 0
+    offsets=numpy.zeros(n_bins+1,dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(entries[:,0],minlength=n_bins),out=offsets[1:])
+    return offsets,numpy.ascontiguousarray(entries[:,1])
@@ -0,0 +1,128 @@
+"""Class to filter a molecular network held as arrays, converted to a networkx graph only to export it
+"""
+
+import numpy
+from scipy import sparse
+from scipy.sparse import csgraph
+from msmolnet.EdgeTable import EdgeTable
+
+class SpectralNetwork:
+    """Molecular network of spectra and their matches, held as an EdgeTable with a sparse adjacency matrix built from it
+    when needed, so the filters work on whole arrays of edges instead of a graph object.
+    The filters give the same network whatever order the spectra and edges are in, apart from ties described in each.
+
+    Parameters:
+    spectra_list -- list of Spectrum objects, the nodes of the network
+    table -- EdgeTable of the matches between the spectra, the edges of the network
+    """
+
+    def __init__(self,spectra_list,edges):
+        self.spectra_list=spectra_list
+        if isinstance(edges,EdgeTable):
+            self.table=edges
+        else:
+            self.table=EdgeTable.from_dict(spectra_list,edges)
+
+    def __len__(self):
+        return len(self.spectra_list)
+
+    def adjacency(self):
+        """Returns the symmetric sparse matrix (CSR) of the cosine scores between the spectra at each pair of list positions
+        """
+        edges=self.table.edges
+        n=len(self.spectra_list)
+        rows=numpy.concatenate((edges['i'],edges['j']))
+        columns=numpy.concatenate((edges['j'],edges['i']))
+        return sparse.csr_matrix((numpy.tile(edges['cosine'],2),(rows,columns)),shape=(n,n))
+
+    def families(self):
+        """Returns the number of molecular families (connected components) and an array of the family of each spectrum
+        """
+        return csgraph.connected_components(self.adjacency(),directed=False)
+
+    def filter_neighbors(self,M):
+        """Takes the maximum number of connections a node can have and returns the filtered network.
+        Each node ranks its edges by cosine score, then by number of matching peaks, then by the position of the other
+        spectrum in the list. An edge is kept if it is among the M best of both of its nodes"""
+        edges=self.table.edges
+        n_edges=len(edges)
+        nodes=numpy.concatenate((edges['i'],edges['j']))
+        partners=numpy.concatenate((edges['j'],edges['i']))
+        rows=numpy.tile(numpy.arange(n_edges),2)
+
+        order=numpy.lexsort((partners,-numpy.tile(edges['peaks'],2),-numpy.tile(edges['cosine'],2),nodes))
+        sorted_nodes=nodes[order]
+        rank=numpy.arange(len(nodes))-numpy.searchsorted(sorted_nodes,sorted_nodes,side='left')
+
+        keep=numpy.bincount(rows[order][rank<M],minlength=n_edges)==2
+        return SpectralNetwork(self.spectra_list,EdgeTable(self.spectra_list,edges[keep]))
+
+    def filter_family(self,M):
+        """Takes an int for threshold molecular family size and returns the filtered network.
+        Removes edges from families that are above the threshold, from the lowest cosine score edges, until the family
+        is small enough, as network.filter_family does. Edges with the same cosine score are removed from the spectra
+        later in the list first.
+        Only the edges of the maximum spanning forest of the large families decide where they split (see _capped_families)"""
+        edges=self.table.edges
+        n=len(self.spectra_list)
+        n_families,labels=self.families()
+        sizes=numpy.bincount(labels,minlength=n_families)
+        in_large=sizes[labels[edges['i']]]>M
+        large=numpy.flatnonzero(in_large)
+        if len(large)==0:
+            return SpectralNetwork(self.spectra_list,self.table)
+
+        #rank the edges of large families from highest cosine
+        order=large[numpy.lexsort((edges['j'][large],edges['i'][large],-edges['cosine'][large]))]
+        rank=numpy.zeros(len(edges),dtype=numpy.int64)
+        rank[order]=numpy.arange(len(order))
+
+        #ranks are all different, so the minimum spanning forest of the ranks is the one union-find makes in rank order
+        weights=sparse.csr_matrix((rank[order]+1.0,(edges['i'][order],edges['j'][order])),shape=(n,n))
+        tree=csgraph.minimum_spanning_tree(weights).tocoo()
+        tree_order=numpy.argsort(tree.data)
+        roots,thresholds=_capped_families(n,tree.row[tree_order],tree.col[tree_order],
+            tree.data[tree_order].astype(numpy.int64)-1,M)
+
+        root_i=roots[edges['i']]
+        keep=~in_large|((root_i==roots[edges['j']])&(rank<thresholds[root_i]))
+        return SpectralNetwork(self.spectra_list,EdgeTable(self.spectra_list,edges[keep]))
+
+    def to_networkx(self):
+        """Returns the network as a networkx graph object, with the spectra as nodes with their metadata (see network.make_network)
+        """
+        from msmolnet import network
+        return network.make_network(self.spectra_list,self.table)
+
+def _capped_families(n,first,second,ranks,M):
+    """Takes the number of spectra, the edges of a maximum spanning forest as arrays of list positions sorted by rank,
+    their ranks and the threshold family size. Returns the family (a root position) of each spectrum after family size
+    filtering, and for each root the rank from which the family's edges are removed.
+    Removing the lowest cosine edges of a family until it splits leaves the two clusters of the last merge of single
+    linkage clustering, so the families are the largest single linkage clusters no larger than M. Clusters are merged
+    in rank order unless the merged cluster would be larger than M, or one of them has already been too large to merge;
+    then both are closed at that rank. A cluster not closed is a whole family with no edges removed"""
+    parent=list(range(n))
+    size=[1]*n
+    thresholds=numpy.full(n,numpy.iinfo(numpy.int64).max)
+    closed=[False]*n
+
+    def find(i):
+        while parent[i]!=i:
+            parent[i]=parent[parent[i]]
+            i=parent[i]
+        return i
+
+    for one,two,rank in zip(first.tolist(),second.tolist(),ranks.tolist()):
+        root_one,root_two=find(one),find(two)
+        if not closed[root_one] and not closed[root_two] and size[root_one]+size[root_two]<=M:
+            parent[root_two]=root_one
+            size[root_one]+=size[root_two]
+            continue
+        for root in (root_one,root_two):
+            if not closed[root]:
+                closed[root]=True
+                thresholds[root]=rank
+
+    roots=numpy.array([find(i) for i in range(n)],dtype=numpy.int64)
+    return roots,thresholds
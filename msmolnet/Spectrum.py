@@ -9,49 +9,107 @@ from functools import total_ordering
 class Spectrum:
     """Class to hold an MS2 Spectrum
 
+    Peaks are stored as contiguous numpy arrays sorted by m/z rather than as a list of Peak objects.
+
     Parameters:
-    peaks -- a list of Peak objects
+    mz -- array of peak masses, sorted in ascending order
+    intensity -- array of peak intensities, in the same order as mz
+    scaled_intensity (after using euclidean_scale method) -- array of square root intensities scaled to Euclidean norm 1
+    peaks -- list of Peak objects made from the arrays each time it is used, for code that works with single peaks
     feature_id -- set from 'scans' in metadata, used as node labels in the network
     parameters -- dictionary of metadata provided in the MGF file
     library_parameters (if similarity.library_match method has been used) --metadata from the matched library spectrum
+    library_hits (if similarity.library_match method has been used) -- best library matches, each with cosine, peaks and parameters
 
     """
+
+    __slots__=('_mz','_intensity','_scaled_intensity','_pending','feature_id','parameters','pep_mass','library_parameters',
+        'library_hits')
+
     def __init__(self):
-        self.peaks = [] #list of peaks in spectrum
+        self._mz=numpy.empty(0)
+        self._intensity=numpy.empty(0)
+        self._scaled_intensity=None
+        self._pending=[] #peaks added with add_peak that are not in the arrays yet
         self.feature_id=None
-        # self.name=False
         self.parameters={}
-        
+
     def __repr__(self):
         # return f"{self.__class__.__name__}({self.peaks})"
         return self.feature_id
-    
+
     def __lt__(self,spectrum):
         if self.pep_mass<spectrum.pep_mass:
             return True
         else:
             return False
 
+    @property
+    def mz(self):
+        self._add_pending()
+        return self._mz
+
+    @property
+    def intensity(self):
+        self._add_pending()
+        return self._intensity
+
+    @property
+    def scaled_intensity(self):
+        return self._scaled_intensity
+
+    @property
+    def peaks(self):
+        """List of Peak objects made from the peak arrays
+        """
+        mz=self.mz.tolist()
+        intensity=self.intensity.tolist()
+
+        peaks=[]
+        for i in range(len(mz)):
+            peak=Peak(mz[i],intensity[i])
+            if self._scaled_intensity is not None:
+                peak.scaled_intensity=float(self._scaled_intensity[i])
+            peaks.append(peak)
+        return peaks
 
     def add_peak(self,mass, intensity):
-        """Create a peak object and add to the list of spectrum peaks
+        """Add a peak to the spectrum. Peaks are collected and added to the arrays the next time they are used
+        """
+        self._pending.append((mass,intensity))
+
+    def set_peaks(self,mz,intensity,scaled_intensity=None):
+        """Set all the peaks of the spectrum from arrays of masses and intensities, sorting them by mass if needed.
+        Already scaled intensities can be given to avoid using euclidean_scale again
+        """
+        mz=numpy.asarray(mz,dtype=numpy.float64)
+        intensity=numpy.asarray(intensity,dtype=numpy.float64)
+        if scaled_intensity is not None:
+            scaled_intensity=numpy.asarray(scaled_intensity,dtype=numpy.float64)
+
+        if len(mz)>1 and numpy.any(mz[1:]<mz[:-1]):
+            order=numpy.argsort(mz,kind='stable')
+            mz=mz[order]
+            intensity=intensity[order]
+            if scaled_intensity is not None:
+                scaled_intensity=scaled_intensity[order]
+
+        self._mz=mz
+        self._intensity=intensity
+        self._scaled_intensity=scaled_intensity
+        self._pending=[]
+
+    def _add_pending(self):
+        """Add peaks from add_peak to the peak arrays
         """
-        self.peaks.append(Peak(mass,intensity))
+        if self._pending:
+            pending=numpy.array(self._pending,dtype=numpy.float64)
+            self.set_peaks(numpy.concatenate((self._mz,pending[:,0])),numpy.concatenate((self._intensity,pending[:,1])))
 
     def euclidean_scale(self):
-        """Scales the intensity of each Peak object using Euclidean norm"""
-        
-        #get list of intensities from spectrum
-        intensities=[]
-        for peak in self.peaks:
-            intensities.append(peak.sqrt_intensity)
-        
-        #calculate norm
-        norm=numpy.linalg.norm(intensities)
-
-        #set each peak's scaled intensity
-        for peak in self.peaks:
-            peak.scaled_intensity=(peak.sqrt_intensity)/norm
+        """Scales the square root intensity of each peak using Euclidean norm"""
+        sqrt_intensity=numpy.sqrt(self.intensity)
+        self._scaled_intensity=sqrt_intensity/numpy.linalg.norm(sqrt_intensity)
 
     def set_id(self):
         """Get scans number from metadata and set as spectrum ID
@@ -62,4 +120,4 @@ class Spectrum:
             self.feature_id=self.parameters['scans']
 
     def __str__(self):
-        return str(self.feature_id)
\ No newline at end of file
+        return str(self.feature_id)
@@ -0,0 +1,134 @@
+"""Methods to save parsed spectra to a binary cache next to an mgf file, and load them back using numpy memory mapping
+so the mgf file only has to be parsed once
+"""
+
+import json
+import os
+import numpy
+from msmolnet.Spectrum import Spectrum
+
+#increase if the layout of the cache files changes so old caches are rebuilt
+CACHE_VERSION=1
+
+ARRAYS=('mz','intensity','scaled_intensity','offsets','pep_mass')
+
+def cache_path(file_path):
+    """Returns the path of the cache directory used for a given mgf file
+    """
+    return f"{file_path}.msmolnet-cache"
+
+def pack_spectra(spectra_list):
+    """Takes a list of Spectrum objects, with intensities already scaled, and packs their peaks into contiguous arrays.
+    Returns a dictionary of the arrays and a list of each spectrum's parameters.
+    The peaks of spectrum i are at positions offsets[i]:offsets[i+1] of the peak arrays.
+    """
+    offsets=numpy.zeros(len(spectra_list)+1,dtype=numpy.int64)
+    numpy.cumsum([len(S.mz) for S in spectra_list],out=offsets[1:])
+
+    packed={
+        'mz':_concatenate([S.mz for S in spectra_list]),
+        'intensity':_concatenate([S.intensity for S in spectra_list]),
+        'scaled_intensity':_concatenate([S.scaled_intensity for S in spectra_list]),
+        'offsets':offsets,
+        #spectra without a precursor mass are stored as NaN
+        'pep_mass':numpy.array([getattr(S,'pep_mass',numpy.nan) for S in spectra_list],dtype=numpy.float64),
+        'parameters':[S.parameters for S in spectra_list],
+    }
+    return packed
+
+def unpack_spectra(packed):
+    """Takes a dictionary made by pack_spectra and returns a list of Spectrum objects.
+    The Spectrum peak arrays are views of the packed arrays, so no peak data is copied.
+    """
+    mz=packed['mz']
+    intensity=packed['intensity']
+    scaled_intensity=packed['scaled_intensity']
+    offsets=packed['offsets'].tolist()
+    pep_mass=packed['pep_mass'].tolist()
+
+    spectra_list=[]
+    for i,parameters in enumerate(packed['parameters']):
+        start,end=offsets[i],offsets[i+1]
+
+        spectrum=Spectrum()
+        spectrum.set_peaks(mz[start:end],intensity[start:end],scaled_intensity[start:end])
+        if pep_mass[i]==pep_mass[i]: #not NaN
+            spectrum.pep_mass=pep_mass[i]
+        spectrum.parameters=parameters
+        spectrum.set_id()
+        spectra_list.append(spectrum)
+
+    return spectra_list
+
+def write_cache(spectra_list,file_path):
+    """Takes a list of Spectrum objects read from an mgf file and the path to that file.
+    Writes the spectra to a cache directory next to the file. Returns False if the cache could not be written.
+    """
+    packed=pack_spectra(spectra_list)
+    metadata={'version':CACHE_VERSION,'source':file_stamp(file_path),'parameters':packed['parameters']}
+    return save_arrays(cache_path(file_path),{name:packed[name] for name in ARRAYS},metadata)
+
+def load_cache(file_path):
+    """Takes the path to an mgf file and loads its cached spectra.
+    Returns a list of Spectrum objects, or None if there is no cache or the mgf file has changed since it was written.
+    """
+    loaded=load_arrays(cache_path(file_path),ARRAYS,CACHE_VERSION,file_path)
+    if loaded is None:
+        return None
+
+    packed,metadata=loaded
+    packed['parameters']=metadata['parameters']
+    return unpack_spectra(packed)
+
+def save_arrays(directory,arrays,metadata):
+    """Takes a directory, a dictionary of numpy arrays and a dictionary of metadata (with 'version' and 'source' keys), and
+    saves each array to a .npy file and the metadata to metadata.json in the directory.
+    Returns False if the files could not be written.
+    """
+    try:
+        os.makedirs(directory,exist_ok=True)
+        for name,array in arrays.items():
+            _replace(os.path.join(directory,f"{name}.npy"),lambda f: numpy.save(f,array))
+
+        #metadata is written last so an interrupted write leaves files that don't match the source file
+        _replace(os.path.join(directory,"metadata.json"),lambda f: f.write(json.dumps(metadata).encode()))
+    except OSError:
+        return False
+
+    return True
+
+def load_arrays(directory,names,version,file_path):
+    """Takes a directory written by save_arrays, the names of its arrays, the version expected and the source file path.
+    Returns a dictionary of the memory mapped arrays and the metadata dictionary, or None if the files are missing, a
+    different version, or the source file has changed since they were written.
+    """
+    try:
+        with open(os.path.join(directory,"metadata.json"),'rb') as f:
+            metadata=json.loads(f.read())
+        if metadata['version']!=version or metadata['source']!=file_stamp(file_path):
+            return None
+
+        arrays={name:numpy.load(os.path.join(directory,f"{name}.npy"),mmap_mode='r') for name in names}
+    except (OSError,ValueError,KeyError):
+        return None
+
+    return arrays,metadata
+
+def file_stamp(file_path):
+    """Size and modification time used to check if a cache still matches its source file
+    """
+    stat=os.stat(file_path)
+    return [stat.st_size,stat.st_mtime_ns]
+
+def _concatenate(arrays):
+    if len(arrays)==0:
+        return numpy.empty(0)
+    return numpy.concatenate(arrays)
+
+def _replace(path,write):
+    """Write a file through a temporary file so readers never see a partly written file
+    """
+    temporary=f"{path}.tmp"
+    with open(temporary,'wb') as f:
+        write(f)
+    os.replace(temporary,path)
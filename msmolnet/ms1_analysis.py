@@ -2,8 +2,15 @@
 """
 
 import csv
+import itertools
+import operator
+from contextlib import nullcontext
+import numpy
 from scipy import stats
 
+#number of rows of the peak area table read and tested at a time
+ROWS_PER_BLOCK=10000
+
 def sample_groups(groups_file):
     """Requires file with two columns 'samples', 'groups', determining which sample is in which of two groups.
     Returns a dictionary of the groups and the samples that belong in them
@@ -20,73 +27,91 @@ def sample_groups(groups_file):
     return groups
 
 
-def samples_ttest(file_path,sample_groups_file,spectra_list):
+def samples_ttest(file_path,sample_groups_file,spectra_list,results_file=None,block_size=ROWS_PER_BLOCK):
     """Takes a csv file path of MS1 peak areas, a csv file path of which group each sample belongs in, and a list of Spectrum objects.
     Performs an independent t-test for each spectrum and adds the results to the Spectrum object.
+    The peak area columns of the samples are found once from the header, and the table is read block_size rows at a time
+    with only those columns kept; the features in each block are tested together. Each row is matched to the spectrum
+    with the same SCANS as its ID.
+    Give results_file to also write the results of every row to a csv file as each block is tested.
     """
     groups=sample_groups(sample_groups_file)
     key1,key2 = groups.keys()
 
-    group1=groups[key1]
-    group2=groups[key2]
-
-    with open(file_path) as csvfile:
-        reader=csv.DictReader(csvfile)
-        for row in reader:
-
-            #peak areas of samples in first group
-            list1=[]
-            for sample in group1:
-                result=[float(value) for key,value in row.items() if str(sample) in key and 'area' in key]
-                if len(result)==1:
-                    list1.append(result[0])
-                elif len(result)==0:
-                    print(f"No MS1 peak area found for sample {sample}")
-
-            #peak areas of samples in second group
-            list2=[]
-            for sample in group2:
-                result=[float(value) for key,value in row.items() if str(sample) in key and 'area' in key]
-                if len(result)==1:
-                    list2.append(result[0])
-                elif len(result)==0:
-                    print(f"No MS1 peak area found for sample {sample}")
-            
-            #t-test to compare the two groups
-            statistic,p_value = stats.ttest_ind(list1,list2)
-            #use p_value threshold of 0.05 for significance
-            if p_value<=0.05:
-                #determine which group has greater intensity value
-                if statistic>0:
-                    greater=key1
+    #first spectrum with each SCANS, as the rows are matched to
+    spectra={}
+    for S in spectra_list:
+        spectra.setdefault(S.parameters.get('SCANS'),S)
+
+    with open(file_path) as csvfile, (open(results_file,'w',newline='') if results_file else nullcontext()) as output:
+        reader=csv.reader(csvfile)
+        header=next(reader)
+        columns1=area_columns(header,groups[key1])
+        columns2=area_columns(header,groups[key2])
+        id_column=[k for k,key in enumerate(header) if 'ID' in key][0]
+
+        if output is not None:
+            writer=csv.writer(output)
+            writer.writerow(['ID','tstatistic','p_value','greater_group'])
+
+        for row_IDs,areas in area_blocks(reader,id_column,columns1+columns2,block_size):
+            #t-test to compare the two groups, one feature in each row
+            statistics,p_values = stats.ttest_ind(areas[:,:len(columns1)],areas[:,len(columns1):],axis=1)
+
+            results=[]
+            for row_ID,statistic,p_value in zip(row_IDs,statistics.tolist(),p_values.tolist()):
+                #use p_value threshold of 0.05 for significance
+                if p_value<=0.05:
+                    #determine which group has greater intensity value
+                    if statistic>0:
+                        greater=key1
+                    else:
+                        greater=key2
                 else:
-                    greater=key2
-            else:
-                greater="No significance"
-
-            spectra_list.sort(key=lambda S: int(S.parameters['SCANS']))
-
-            row_ID=[value for key,value in row.items() if 'ID' in key]
-            row_ID=row_ID[0]
-
-            #find spectrum that the row corresponds to and add t-test info
-            added=False
-            for i in range(len(spectra_list)):
-                for S in spectra_list[i:]:
-                    if S.parameters['SCANS'] == row_ID:
-                        S.parameters['greater_group']=greater
-                        S.parameters['tstatistic']=statistic
-                        S.parameters['p_value']=p_value
-                        added=True
-                        break
-
-                if added:
-                    break
-
-
-
-
-            
+                    greater="No significance"
+                results.append((row_ID,statistic,p_value,greater))
+
+                #add t-test info to the spectrum that the row corresponds to
+                S=spectra.get(row_ID)
+                if S is not None:
+                    S.parameters['greater_group']=greater
+                    S.parameters['tstatistic']=statistic
+                    S.parameters['p_value']=p_value
+
+            if output is not None:
+                writer.writerows(results)
+
+def area_blocks(reader,id_column,columns,block_size=ROWS_PER_BLOCK):
+    """Takes a csv reader positioned after the header of a csv file of MS1 peak areas, the position of the ID column and
+    a list of the positions of the peak area columns to keep. Yields the rows block_size at a time, as a list of the row
+    IDs and a 2-D array of the peak areas (rows by columns). Other columns are not converted or kept"""
+    get_areas=operator.itemgetter(*columns) if columns else (lambda row: ())
+    while True:
+        row_IDs=[]
+        areas=[]
+        n_read=0
+        for row in itertools.islice(reader,block_size):
+            n_read+=1
+            if not row:
+                continue
+            row_IDs.append(row[id_column])
+            areas.append(get_areas(row))
+        if n_read==0:
+            return
+        yield row_IDs,numpy.array(areas,dtype=numpy.float64).reshape(len(row_IDs),len(columns))
+
+def area_columns(header,samples):
+    """Takes the header of a csv file of MS1 peak areas and a list of sample names, and returns a list of the positions of
+    the peak area columns of the samples: the one column with the sample name and 'area' in its name.
+    Samples with no peak area column, or more than one, are left out"""
+    columns=[]
+    for sample in samples:
+        found=[k for k,key in enumerate(header) if str(sample) in key and 'area' in key]
+        if len(found)==1:
+            columns.append(found[0])
+        elif len(found)==0:
+            print(f"No MS1 peak area found for sample {sample}")
+    return columns
 
 
 # samples_ttest("C:\\Users\\Kiah\\Documents\\Project\dummy_MS1.csv","C:\\Users\\Kiah\\Documents\\Project\\groups.csv")
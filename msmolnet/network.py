@@ -2,88 +2,169 @@
 """
 
 import networkx as nx
+from msmolnet.EdgeTable import EdgeTable
 
 def make_network(nodes,edges):
-    """Takes a list of Spectrum objects and a dictionary of spectrum matches and returns a NetworkX graph object
+    """Takes a list of Spectrum objects and a dictionary (or EdgeTable) of spectrum matches and returns a NetworkX graph object
     """
     #make network
-    network=nx.Graph(edges)
+    if isinstance(edges,EdgeTable):
+        network=nx.Graph()
+        network.add_nodes_from(edges.network_nodes())
+        network.add_edges_from(edges.network_edges())
+    else:
+        network=nx.Graph(edges)
+    add_nodes(network,nodes)
 
-    #add metadata to nodes
-    attributes={}
+    return network
+
+def add_nodes(network,nodes):
+    """Takes a networkx graph object and a list of Spectrum objects and adds the spectra as nodes with their metadata
+    """
     for N in nodes:
-        network.add_node(N)
-        attributes[N]={}
-        if hasattr(N,'parameters'):
-            for P in N.parameters:
-                attributes[N][P]=str(N.parameters[P])
-        
-        if hasattr(N, 'library_parameters'):
-            network.add_node(N,library_match=True)
-            for L in N.library_parameters:
-                attributes[N]["".join(["library_",L])]=N.library_parameters[L]
-        else:
-            network.add_node(N,library_match=False)
-          
-    nx.set_node_attributes(network,attributes)
+        network.add_node(N,**node_attributes(N))
 
-    return network
+def node_attributes(N):
+    """Takes a Spectrum object and returns a dictionary of the metadata exported with it as a network node
+    """
+    attributes={'library_match':hasattr(N,'library_parameters')}
+    if hasattr(N,'parameters'):
+        for P in N.parameters:
+            attributes[P]=str(N.parameters[P])
+
+    if hasattr(N, 'library_parameters'):
+        for L in N.library_parameters:
+            attributes["".join(["library_",L])]=N.library_parameters[L]
+
+    #library matches after the best one, numbered from 2
+    for rank,hit in enumerate(getattr(N,'library_hits',[])[1:],start=2):
+        attributes[f"library_{rank}_cosine"]=hit['cosine']
+        attributes[f"library_{rank}_peaks"]=hit['peaks']
+        for L in hit['parameters']:
+            attributes[f"library_{rank}_{L}"]=hit['parameters'][L]
+    return attributes
+
+def extend_network(graph,existing_spectra,new_spectra,fragment_tolerance=0.3,modified=False,precursor_tolerance=1.0,
+                   greedy=False,cosine_threshold=0.7,peak_threshold=6,n_neighbours=10,family_size=100,workers=1):
+    """Takes a networkx graph object made from a list of Spectrum objects, that list, and a list of new Spectrum objects.
+    Only pairs of spectra with a new spectrum are scored (see similarity.compare_all for the scoring options). The new
+    spectra and the matches that pass the thresholds are added to the graph, then filter_neighbors and filter_family are
+    applied again only to the molecular families that have new spectra.
+    Edges already removed by filtering are not added back.
+    Returns the extended network and the list of all the spectra"""
+    from msmolnet import similarity
+
+    spectra_list=list(existing_spectra)+list(new_spectra)
+    pairs=similarity.new_pairs(spectra_list,len(existing_spectra),precursor_tolerance)
+    matches=similarity.compare_all(spectra_list,fragment_tolerance,modified,precursor_tolerance,greedy,workers,
+        cosine_threshold=cosine_threshold,peak_threshold=peak_threshold,pairs=pairs)
+
+    add_nodes(graph,new_spectra)
+    for N in matches:
+        for P,match in matches[N].items():
+            graph.add_edge(N,P,**match)
 
-def filter_neighbors(graph,M):
+    #families with a new spectrum, in graph order so filtering gives the same result as filtering the whole network
+    touched=set()
+    for N in new_spectra:
+        if N not in touched:
+            touched.update(nx.node_connected_component(graph,N))
+    graph=filter_neighbors(graph,n_neighbours,nodes=[N for N in graph if N in touched])
+
+    touched=set()
+    for N in new_spectra:
+        if N not in touched:
+            touched.update(nx.node_connected_component(graph,N))
+    graph=filter_family(graph,family_size,nodes=[N for N in graph if N in touched])
+
+    return graph,spectra_list
+
+def filter_neighbors(graph,M,nodes=None):
     """Takes networkx graph object and an int as the maximum numbers of connections a node can have
-    Edges are removed from each node from the lowest cosine score, until the node has below the threshold number.
+    Each node ranks its edges by cosine score, then by number of matching peaks, then by the graph order of the other node.
+    An edge is kept if it is among the M best of both of its nodes, so the result doesn't depend on the order the nodes
+    are filtered in. Give a list of nodes to only filter the edges of those nodes.
     Returns the filtered network
     """
-    for node in nx.nodes(graph):
+    if nodes is None:
+        nodes=list(nx.nodes(graph))
+    position={node:i for i,node in enumerate(graph)}
 
-        #sort edges connecting to query node by descending cosine score
-        edges = sorted(graph.edges(node,data=True), key=lambda x: x[2]['cosine'],reverse=True)
+    best={}
+    def top(node):
+        if node not in best:
+            #sort edges connecting to query node by descending cosine score
+            partners=sorted(graph[node],key=lambda partner: (-graph[node][partner]['cosine'],
+                -graph[node][partner].get('peaks',0),position[partner]))
+            best[node]=set(partners[:M])
+        return best[node]
+
+    remove=[(node,partner) for node in nodes for partner in graph[node] if partner not in top(node) or node not in top(partner)]
+    graph.remove_edges_from(remove)
 
-        if len(edges)>M: #if too many neighbours i.e. connecting edges
-            graph.remove_edges_from(edges[M:]) #remove edges from lowest cosine score end of list
-    
     return graph
 
-def filter_family(graph, M):
+def filter_family(graph, M, nodes=None):
     """Takes a networkx graph object and an int for threshold molecular family size in the network.
     Removes edges from families that are above the threshold, from the lowest cosine score edges, until the family is small enough.
+    Give a list of nodes to only filter the families of those nodes.
+    Edges with the same cosine score are removed in reverse graph order.
     Returns the filtered network.
     """
+    if nodes is None:
+        nodes=list(nx.nodes(graph))
+    wanted=set(nodes)
+    position={node:i for i,node in enumerate(graph)}
 
-    used=[]
-    for node in nx.nodes(graph):
+    used=set()
+    for node in nodes:
 
         #don't recheck any nodes in a family that has already been filtered
         if node in used:
             continue
 
-        while True:
-            family=nx.node_connected_component(graph,node)
-
-            if len(family)>M:
-                #sort from highest to lowest cosine
-                edges = sorted(graph.edges(family,data=True), key=lambda x: x[2]['cosine'],reverse=True)
-                while True:
-                    #get edge to remove
-                    remove=edges[-1]
-                    #remove that edge from the lsit of existing edges
-                    edges=edges[:-1]
-                    #remove edge from the network
-                    graph.remove_edge(remove[0],remove[1])
-
-                    #check if there is a path from the two nodes that the edge was removed from
-                    #if a path exists then the family was not broken and another edge should be removed
-                    if not nx.has_path(graph,remove[0],remove[1]):
-                        break
-                
-                continue
-                
-            for F in family:
-                used.append(F)
-            break
+        family=nx.node_connected_component(graph,node)
+        used.update(family)
+        if len(family)>M:
+            graph.remove_edges_from(_family_cuts(graph,sorted(family,key=position.get),M,wanted))
 
     return graph
 
+def _family_cuts(graph,family,M,wanted):
+    """Takes a networkx graph object, the nodes of a family in graph order, the threshold family size and a set of the
+    nodes to filter, and returns the edges filter_family removes from the family.
+    Removing the lowest cosine edges until an edge splits the family leaves the edges added before the last merge of
+    single linkage clustering (union-find over the edges from highest cosine), so the family splits into the two clusters
+    of that merge. Each cluster above the threshold with a node to filter is split again the same way. An edge is removed
+    if the cluster it is in when it is added is split, which is found in one pass"""
+    index={node:i for i,node in enumerate(family)}
+    edges=sorted(graph.edges(family,data='cosine'),key=lambda edge: edge[2],reverse=True)
+
+    n=len(family)
+    parent=list(range(n))
+    #clusters 0..n-1 are the single nodes, then one cluster for each merge
+    cluster=list(range(n))
+    size=[1]*n
+    has_wanted=[node in wanted for node in family]
+
+    def find(i):
+        while parent[i]!=i:
+            parent[i]=parent[parent[i]]
+            i=parent[i]
+        return i
+
+    edge_clusters=[]
+    for one,two,cosine in edges:
+        root_one,root_two=find(index[one]),find(index[two])
+        if root_one!=root_two:
+            size.append(size[cluster[root_one]]+size[cluster[root_two]])
+            has_wanted.append(has_wanted[cluster[root_one]] or has_wanted[cluster[root_two]])
+            parent[root_two]=root_one
+            cluster[root_one]=len(size)-1
+        edge_clusters.append(cluster[root_one])
+
+    return [(one,two) for (one,two,cosine),c in zip(edges,edge_clusters) if size[c]>M and has_wanted[c]]
+
 def write_graphml(graph, file_name):
     """Takes a networkx graph object and a file name and writes the network to a graphml file
     """
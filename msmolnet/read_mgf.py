@@ -1,58 +1,158 @@
 """Method to load an mgf file and make Spectrum objects
 """
 
+import io
+import os
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from msmolnet.Spectrum import Spectrum
+from msmolnet import mgf_cache
 
-def read_mgf(file_path):
+#smallest part of a file given to each process when parsing in parallel
+MIN_CHUNK_BYTES=1<<20
+
+def read_mgf(file_path,cache=True,workers=1):
     """Takes the path to a .mgf file. Returns a list of Spectrum objects, each containing the attributes contained in the
-    file and a list of Peak objects"""
-    file = open(file_path)
-    #split file into list of lines
-    lines = file.read().split('\n')
+    file and the peak arrays.
+    By default the spectra are saved to a binary cache next to the file after the first read, and later reads load the
+    cache instead of parsing the file again as long as the file has not changed. Use cache=False to always parse the file.
+    Use workers to parse large files with more than one process"""
+    if cache:
+        spectra_list=mgf_cache.load_cache(file_path)
+        if spectra_list is not None:
+            return spectra_list
 
-    #initiate list to hold all the Spectrum objects
-    spectra_list=[]
+    if workers==1:
+        spectra_list=list(iter_mgf(file_path))
+    else:
+        spectra_list=read_mgf_parallel(file_path,workers)
+
+    if cache:
+        mgf_cache.write_cache(spectra_list,file_path)
+
+    return spectra_list
+
+def iter_mgf(file_path):
+    """Takes the path to a .mgf file and parses it line by line.
+    Yields each Spectrum object as soon as its 'END IONS' line is reached, so the whole file is never held in memory"""
+    with open(file_path) as file:
+        yield from parse_lines(file)
+
+def parse_lines(lines):
+    """Takes an iterable of mgf lines and yields a finished Spectrum object for each 'BEGIN IONS'/'END IONS' block"""
+    spectrum=None
 
     for line in lines:
+        line=line.rstrip('\n')
+
         if 'BEGIN IONS' in line:
-            spectrum_lines = [] #initiate new spectra list to contain lines of the next spectra data
             spectrum = Spectrum() #initiate new spectrum object
             continue
-   
+
+        #ignore anything outside of a spectrum block
+        if spectrum is None:
+            continue
+
         if 'END IONS' in line:
-            #at end of current spectra, parse the data
-            
-            
-            for i in spectrum_lines:
-                
-                #extract parameter values and assign to attributes
-                if "=" in i:
-                    parameter,value = i.split("=",1)
-                    # if "scans".casefold() in parameter.casefold():
-                    #     spectrum.set_id(value)
-                    if "pepmass".casefold() in parameter.casefold():
-                        spectrum.pep_mass = float(value)
-
-                    spectrum.parameters[parameter]=value
-                    spectrum.set_id()
-
-                    
-
-                #when it reaches a line with no '=' and it's not an empty line then it is one of the peaks, which is added to the spectrum
-                elif i != "":                    
-                    mass, intensity = i.split()
-                    mass = float(mass)
-                    intensity = float(intensity)
-                    spectrum.add_peak(mass, intensity)
-            
-            spectrum.set_id
             #intensities scaled by Euclidean norm
             spectrum.euclidean_scale()
+            yield spectrum
+            spectrum=None
+            continue
+
+        #extract parameter values and assign to attributes
+        if "=" in line:
+            parameter,value = line.split("=",1)
+            if "pepmass".casefold() in parameter.casefold():
+                spectrum.pep_mass = float(value)
+
+            spectrum.parameters[parameter]=value
+            spectrum.set_id()
+
+        #when it reaches a line with no '=' and it's not an empty line then it is one of the peaks, which is added to the spectrum
+        elif line != "":
+            mass, intensity = line.split()
+            mass = float(mass)
+            intensity = float(intensity)
+            spectrum.add_peak(mass, intensity)
 
-            spectra_list.append(spectrum)  
-         
-        #add line to existing spectra info
-        spectrum_lines.append(line)
+def read_mgf_parallel(file_path,workers=None,chunks=None):
+    """Takes the path to a .mgf file and parses it with a pool of processes.
+    The file is split into byte ranges at 'BEGIN IONS' lines, each range is parsed in a separate process and the spectra
+    are returned in file order, the same as read_mgf.
+    workers -- number of processes, defaults to the number of CPUs
+    chunks -- number of byte ranges, defaults to four per process for files large enough to split
+    """
+    if workers is None:
+        workers=os.cpu_count()
+    if chunks is None:
+        chunks=min(workers*4,os.path.getsize(file_path)//MIN_CHUNK_BYTES)
 
-    file.close()
+    ranges=spectrum_ranges(file_path,chunks)
+    if len(ranges)<=1:
+        return list(iter_mgf(file_path))
+
+    starts,ends=zip(*ranges)
+    spectra_list=[]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        #spectra are sent back from the processes as packed arrays rather than as Spectrum objects
+        for packed in executor.map(_parse_range,repeat(file_path),starts,ends):
+            spectra_list.extend(mgf_cache.unpack_spectra(packed))
+
+    return spectra_list
+
+def spectrum_ranges(file_path,chunks):
+    """Takes the path to a .mgf file and splits it into about the given number of byte ranges.
+    Every range except the first starts at the beginning of a 'BEGIN IONS' line, so no spectrum is split between ranges.
+    Returns a list of (start, end) byte positions
+    """
+    size=os.path.getsize(file_path)
+    boundaries=[0]
+
+    with open(file_path,'rb') as file:
+        for k in range(1,chunks):
+            position=_next_begin_ions(file,size*k//chunks)
+            if boundaries[-1]<position<size:
+                boundaries.append(position)
+
+    boundaries.append(size)
+    return list(zip(boundaries[:-1],boundaries[1:]))
+
+def _next_begin_ions(file,offset):
+    """Returns the position of the first line containing 'BEGIN IONS' that starts at or after the offset
+    """
+    #move to the start of the first line at or after the offset
+    file.seek(max(offset-1,0))
+    if offset>0:
+        file.readline()
+
+    while True:
+        position=file.tell()
+        line=file.readline()
+        if not line or b'BEGIN IONS' in line:
+            return position
+
+def read_range(file_path,start,end):
+    """Takes the path to a .mgf file and a byte range starting at a 'BEGIN IONS' line.
+    Returns a list of the Spectrum objects in that part of the file"""
+    return read_ranges(file_path,[(start,end)])
+
+def read_ranges(file_path,ranges):
+    """Takes the path to a .mgf file and a list of (start, end) byte ranges, each starting at a 'BEGIN IONS' line.
+    Returns a list of the Spectrum objects in those parts of the file, in the order of the ranges.
+    The file is only opened once"""
+    spectra_list=[]
+    with open(file_path,'rb') as file:
+        for start,end in ranges:
+            file.seek(start)
+            data=file.read(end-start)
+
+            #decode the same way as open() does in text mode, including newline handling
+            lines=io.TextIOWrapper(io.BytesIO(data))
+            spectra_list.extend(parse_lines(lines))
     return spectra_list
+
+def _parse_range(file_path,start,end):
+    """Parses the spectra in a byte range of a .mgf file and returns them packed into arrays
+    """
+    return mgf_cache.pack_spectra(read_range(file_path,start,end))
@@ -2,50 +2,405 @@
 Methods to carry out cosine similarity calculations and filtering, and library matching
 """
 
-import networkx as nx
-import bisect
+import itertools
+import tempfile
+import numpy
+from scipy import sparse
+from scipy.optimize import linear_sum_assignment
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from msmolnet import network
 from msmolnet.Peak import Peak
 from msmolnet.Spectrum import Spectrum
-from msmolnet import read_mgf as mgf
+from msmolnet import mgf_cache
+from msmolnet import ScoreCache
+from msmolnet.EdgeTable import EdgeTable
+from msmolnet.SpectralLibrary import SpectralLibrary, ANALOG_CANDIDATES
+from msmolnet.ShardedLibrary import ShardedLibrary
 
+#extra width added to the peak mass search window so rounding never leaves out a matching peak
+SEARCH_SLACK=1e-6
 
-def compare_all(spectra_list,fragment_tolerance=0.3, modified=False,precursor_tolerance=1.0,greedy=False):
+#fraction of the highest peak matching weight within which matchings with more peak pairs are preferred
+TIE_TOLERANCE=1e-12
+
+#number of spectrum pairs handled together when scoring many pairs
+BLOCK_SIZE=10000
+
+#number of blocks of pairs waiting for each process when scoring in parallel
+PENDING_PER_WORKER=4
+
+#number of spectra multiplied together at a time when calculating binned approximate cosines
+ROWS_PER_BLOCK=1000
+
+#allowance for rounding when comparing a score upper bound with a threshold
+BOUND_SLACK=1e-9
+
+#number of query spectra sent to a process at a time when searching a library in parallel
+QUERIES_PER_BATCH=100
+
+def compare_all(spectra_list,fragment_tolerance=0.3, modified=False,precursor_tolerance=1.0,greedy=False,workers=1,
+                cosine_threshold=None,peak_threshold=None,prefilter=None,pairs=None,score_cache=None,
+                as_table=False):
     """Takes a list of spectrum objects and calculates modified cosine for each spectrum matched with every other spectrum.
-    returns a nested dictionary of spectrum matches with cosine score and number of matching peaks"""
+    Only pairs of spectra with precursor masses within precursor_tolerance of each other are scored (see candidate_pairs).
+    Use workers to score the pairs with more than one process; the matches are the same for any number of workers.
+    Give cosine_threshold and peak_threshold to only keep matches that pass them, the same as using filter_pairs after.
+    Pairs that can't pass are skipped before calculating the exact score.
+    Give prefilter a cutoff to only score pairs whose binned approximate cosine is at least the cutoff (see prefilter_pairs).
+    Give pairs as two arrays of list positions (first, second), for example from NeighbourIndex.candidate_pairs, to only
+    score those pairs. With prefilter as well, only the given pairs with an approximate cosine of at least the cutoff are
+    scored.
+    Give score_cache a ScoreCache to reuse the scores of pairs scored in earlier runs with the same parameters, and save
+    the scores of the new pairs to it.
+    returns a nested dictionary of spectrum matches with cosine score and number of matching peaks, or with as_table=True
+    an EdgeTable holding each match once"""
+    options=(fragment_tolerance,modified,precursor_tolerance,greedy,cosine_threshold,peak_threshold)
+    matches=EdgeTable.from_blocks(spectra_list,_scored_blocks(spectra_list,options,workers,prefilter,pairs,score_cache))
+    if as_table:
+        return matches
+    return matches.to_dict()
 
-    #dictionary to store spectral matches
-    matches = {}   
-    
-    for i in range(0,len(spectra_list)):
-        
-        # # optional print of list position to track progress
-        # print(i)
+def iter_matches(spectra_list,cosine_threshold=0.7,peak_threshold=6,fragment_tolerance=0.3,modified=False,
+                 precursor_tolerance=1.0,greedy=False,workers=1,prefilter=None,pairs=None,score_cache=None):
+    """Takes a list of Spectrum objects and yields the matches that pass cosine_threshold and peak_threshold as they are
+    scored, as tuples of list positions, cosine score and number of matching peaks (i, j, cosine, peaks), in the same order
+    as compare_all. Only one block of scored pairs is in memory at a time. See compare_all for the other options"""
+    options=(fragment_tolerance,modified,precursor_tolerance,greedy,cosine_threshold,peak_threshold)
+    for first,second,scores,peak_counts in _scored_blocks(spectra_list,options,workers,prefilter,pairs,score_cache):
+        yield from zip(first.tolist(),second.tolist(),scores.tolist(),peak_counts.tolist())
 
+def write_matches(file_path,spectra_list,cosine_threshold=0.7,peak_threshold=6,fragment_tolerance=0.3,modified=False,
+                  precursor_tolerance=1.0,greedy=False,workers=1,prefilter=None,pairs=None,score_cache=None):
+    """Takes a file path and a list of Spectrum objects and writes the matches that pass cosine_threshold and
+    peak_threshold to the file as they are scored, as binary EdgeTable rows (read them back with EdgeTable.from_file).
+    See compare_all for the other options. Returns the number of matches written"""
+    options=(fragment_tolerance,modified,precursor_tolerance,greedy,cosine_threshold,peak_threshold)
+    n_matches=0
+    with open(file_path,'wb') as file:
+        for block in _scored_blocks(spectra_list,options,workers,prefilter,pairs,score_cache):
+            table=EdgeTable.from_blocks(spectra_list,[block])
+            table.edges.tofile(file)
+            n_matches+=len(table)
+    return n_matches
+
+def _scored_blocks(spectra_list,options,workers=1,prefilter=None,pairs=None,score_cache=None):
+    """Takes a list of Spectrum objects and the score_pairs options, picks the pairs to score (all pairs in precursor windows,
+    prefiltered pairs, the given pairs, or the given pairs that pass the prefilter) and yields the scored blocks of pairs
+    from score_pairs in order"""
+    fragment_tolerance,modified,precursor_tolerance=options[:3]
+    if pairs is not None:
+        first,second=numpy.asarray(pairs[0]),numpy.asarray(pairs[1])
+        blocks=((first[k:k+BLOCK_SIZE],second[k:k+BLOCK_SIZE]) for k in range(0,len(first),BLOCK_SIZE))
+        if prefilter is not None:
+            blocks=_prefilter_blocks(spectra_list,blocks,fragment_tolerance,prefilter)
+    elif prefilter is None:
+        blocks=candidate_pairs(spectra_list,precursor_tolerance)
+    else:
+        blocks=prefilter_pairs(spectra_list,fragment_tolerance,precursor_tolerance,prefilter)
+
+    if score_cache is None:
+        return _score_all(spectra_list,blocks,options,workers)
+    return _score_cached(spectra_list,blocks,options,workers,score_cache)
+
+def score_pairs(spectra_list,first,second,fragment_tolerance=0.3,modified=False,precursor_tolerance=1.0,greedy=False,
+                cosine_threshold=None,peak_threshold=None):
+    """Takes a list of Spectrum objects and two arrays of list positions, and scores each pair of spectra first[k], second[k].
+    Returns arrays of the first positions, second positions, cosine scores and numbers of matched peaks for the pairs that
+    match, leaving out pairs that score 0 with 0 peaks (no matching peaks or precursor mass too far away).
+    If cosine_threshold or peak_threshold are given, only pairs that pass them are returned, and pairs that can't pass
+    them (see could_pass) are left out without calculating the exact score"""
+    scores=numpy.zeros(len(first))
+    peak_counts=numpy.zeros(len(first),dtype=numpy.int64)
+
+    for k,(i,j) in enumerate(zip(first.tolist(),second.tolist())):
         spectrum_one=spectra_list[i]
-        for j in range(i+1,len(spectra_list)):
-            spectrum_two=spectra_list[j]
-                            
-            #cosine score calculation
-            if greedy:
-                score,peak_count=cosine_score_greedy(spectrum_one,spectrum_two,fragment_tolerance,modified,precursor_tolerance)
-            else:
-                score,peak_count=cosine_score_max(spectrum_one,spectrum_two,fragment_tolerance,modified,precursor_tolerance)
-    
-            #if spectra don't match/precursor mass too far away, don't add to list
-            if(score==0 and peak_count==0):
+        spectrum_two=spectra_list[j]
+
+        modification=spectrum_two.pep_mass-spectrum_one.pep_mass
+        if abs(modification)>precursor_tolerance:
+            continue
+        if modified==False:
+            modification=0
+
+        pairs=peak_pairs(spectrum_one,spectrum_two,fragment_tolerance,modification)
+        if not could_pass(*pairs,cosine_threshold,peak_threshold):
+            continue
+
+        #cosine score calculation
+        if greedy:
+            scores[k],peak_counts[k]=greedy_matching(*pairs)
+        else:
+            scores[k],peak_counts[k]=max_weight_matching(*pairs)
+
+    matched=(scores!=0)|(peak_counts!=0)
+    if cosine_threshold is not None:
+        matched&=scores>=cosine_threshold
+    if peak_threshold is not None:
+        matched&=peak_counts>=peak_threshold
+    return first[matched],second[matched],scores[matched],peak_counts[matched]
+
+def _score_all(spectra_list,blocks,options,workers):
+    """Takes a list of Spectrum objects, an iterable of blocks of pairs (first, second) and the score_pairs options.
+    Yields the scored pairs of each block from score_pairs, in the same order as the blocks
+    """
+    if workers==1:
+        for first,second in blocks:
+            yield score_pairs(spectra_list,first,second,*options)
+        return
+
+    #spectra are put into shared memory once instead of being sent to the processes with every block
+    shared,layout=_share_spectra(spectra_list)
+    try:
+        with ProcessPoolExecutor(max_workers=workers,initializer=_attach_spectra,initargs=(layout,)) as executor:
+            #only a few blocks per process are waiting at a time so the pairs are never all in memory
+            pending=deque()
+            for first,second in blocks:
+                pending.append(executor.submit(_score_block,first,second,options))
+                if len(pending)>=workers*PENDING_PER_WORKER:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        for memory in shared:
+            memory.close()
+            memory.unlink()
+
+def _score_cached(spectra_list,blocks,options,workers,score_cache):
+    """Like _score_all, but pairs found in the ScoreCache are not scored again, and the scores of the other pairs are saved.
+    New pairs are scored without the thresholds so the exact score is saved, and the thresholds are applied after"""
+    hashes=[ScoreCache.spectrum_hash(S) for S in spectra_list]
+    parameters=ScoreCache.parameter_key(*options[:4])
+    cosine_threshold,peak_threshold=options[4:]
+    looked_up=deque()
+
+    def new_pairs():
+        for first,second in blocks:
+            cosine,peaks,found=score_cache.lookup(hashes,first,second,parameters)
+            looked_up.append((first,second,cosine,peaks,found))
+            yield first[~found],second[~found]
+
+    #blocks are scored in order, so each scored block is the new pairs of the oldest block looked up
+    for new_first,new_second,new_scores,new_peak_counts in _score_all(spectra_list,new_pairs(),options[:4]+(None,None),workers):
+        first,second,cosine,peaks,found=looked_up.popleft()
+        new=numpy.flatnonzero(~found)
+
+        #positions in the block of the pairs that matched
+        keys=first[new]*len(spectra_list)+second[new]
+        order=numpy.argsort(keys,kind='stable')
+        matched=new[order[numpy.searchsorted(keys[order],new_first*len(spectra_list)+new_second)]]
+        cosine[matched]=new_scores
+        peaks[matched]=new_peak_counts
+        score_cache.store(hashes,first[new],second[new],cosine[new],peaks[new],parameters)
+
+        kept=(cosine!=0)|(peaks!=0)
+        if cosine_threshold is not None:
+            kept&=cosine>=cosine_threshold
+        if peak_threshold is not None:
+            kept&=peaks>=peak_threshold
+        yield first[kept],second[kept],cosine[kept],peaks[kept]
+
+def _share_spectra(spectra_list):
+    """Copy the peaks and precursor masses of a list of spectra into shared memory.
+    Returns the shared memory blocks and a description of them for _attach_spectra
+    """
+    packed=mgf_cache.pack_spectra(spectra_list)
+    shared=[]
+    layout={}
+    for name in ('mz','intensity','scaled_intensity','offsets','pep_mass'):
+        array=packed[name]
+        memory=shared_memory.SharedMemory(create=True,size=max(array.nbytes,1))
+        shared.append(memory)
+        numpy.ndarray(array.shape,dtype=array.dtype,buffer=memory.buf)[:]=array
+        layout[name]=(memory.name,array.shape,array.dtype.str)
+    return shared,layout
+
+def _attach_spectra(layout):
+    """Process pool initializer: rebuild the list of spectra from shared memory, with peak arrays that are views of it
+    """
+    global _worker_spectra, _worker_memory
+    _worker_memory=[]
+    arrays={}
+    for name,(memory_name,shape,dtype) in layout.items():
+        memory=shared_memory.SharedMemory(name=memory_name)
+        _worker_memory.append(memory)
+        arrays[name]=numpy.ndarray(shape,dtype=dtype,buffer=memory.buf)
+
+    offsets=arrays['offsets'].tolist()
+    _worker_spectra=[]
+    for i,pep_mass in enumerate(arrays['pep_mass'].tolist()):
+        spectrum=Spectrum()
+        peaks=slice(offsets[i],offsets[i+1])
+        spectrum.set_peaks(arrays['mz'][peaks],arrays['intensity'][peaks],arrays['scaled_intensity'][peaks])
+        spectrum.pep_mass=pep_mass
+        _worker_spectra.append(spectrum)
+
+def _score_block(first,second,options):
+    """Score a block of pairs in a pool process. Returns the scored pairs as arrays
+    """
+    return score_pairs(_worker_spectra,first,second,*options)
+
+def candidate_pairs(spectra_list,precursor_tolerance=1.0,start=0,stop=None,block_size=BLOCK_SIZE):
+    """Takes a list of Spectrum objects and yields the pairs of list positions (i, j) with i<j whose precursor masses are
+    within precursor_tolerance of each other, in the same order as looping over every i then every j.
+    Spectra are sorted by precursor mass so only the spectra inside each spectrum's precursor window are looked at.
+    Pairs are yielded in blocks of about block_size as two arrays of positions.
+    start and stop limit the first positions i to a range of the list"""
+    if stop is None:
+        stop=len(spectra_list)
+
+    pep_mass=numpy.array([S.pep_mass for S in spectra_list],dtype=numpy.float64)
+    order,lo,hi=precursor_windows(pep_mass,precursor_tolerance)
+
+    block_first=[]
+    block_second=[]
+    n_pairs=0
+    for i in range(start,stop):
+        partners=order[lo[i]:hi[i]]
+        partners=numpy.sort(partners[partners>i])
+        partners=partners[numpy.abs(pep_mass[partners]-pep_mass[i])<=precursor_tolerance]
+
+        block_first.append(numpy.full(len(partners),i))
+        block_second.append(partners)
+        n_pairs+=len(partners)
+
+        if n_pairs>=block_size:
+            yield numpy.concatenate(block_first),numpy.concatenate(block_second)
+            block_first,block_second,n_pairs=[],[],0
+
+    if n_pairs>0:
+        yield numpy.concatenate(block_first),numpy.concatenate(block_second)
+
+def new_pairs(spectra_list,n_existing,precursor_tolerance=1.0):
+    """Takes a list of Spectrum objects where the spectra after the first n_existing are new, and returns the pairs of list
+    positions (i, j) with i<j and j new whose precursor masses are within precursor_tolerance of each other, as two arrays
+    sorted by i then j (the pairs from candidate_pairs that have a new spectrum)"""
+    pep_mass=numpy.array([S.pep_mass for S in spectra_list],dtype=numpy.float64)
+    order,lo,hi=precursor_windows(pep_mass,precursor_tolerance)
+
+    first=[numpy.empty(0,dtype=numpy.int64)]
+    second=[numpy.empty(0,dtype=numpy.int64)]
+    for j in range(n_existing,len(spectra_list)):
+        partners=order[lo[j]:hi[j]]
+        partners=partners[partners<j]
+        partners=partners[numpy.abs(pep_mass[j]-pep_mass[partners])<=precursor_tolerance]
+        first.append(partners)
+        second.append(numpy.full(len(partners),j))
+
+    first,second=numpy.concatenate(first),numpy.concatenate(second)
+    order=numpy.lexsort((second,first))
+    return first[order],second[order]
+
+def prefilter_pairs(spectra_list,fragment_tolerance=0.3,precursor_tolerance=1.0,cutoff=0.7,bin_width=None,rows_per_block=ROWS_PER_BLOCK):
+    """Takes a list of Spectrum objects and yields blocks of pairs of list positions (first, second), like candidate_pairs,
+    but only for pairs whose approximate cosine from binned spectra is at least the cutoff.
+    Approximate cosines are calculated with sparse matrix products, a block of rows at a time. The rows of a block are
+    split into groups with nearby precursor masses, and each group is only multiplied by the spectra in its precursor
+    window (see _window_groups), so peaks in bins common to most spectra don't make the products dense.
+    With bin_width at least fragment_tolerance (the default is fragment_tolerance), matching peaks are always in the same or
+    neighbouring bins, and the approximate cosine is never below the unmodified cosine, so no unmodified matches above the
+    cutoff are lost. Peaks that only match after shifting by the precursor mass difference are not counted, so use a
+    relaxed cutoff below the score threshold for modified cosine."""
+    if bin_width is None:
+        bin_width=fragment_tolerance+SEARCH_SLACK
+
+    pep_mass=numpy.array([S.pep_mass for S in spectra_list],dtype=numpy.float64)
+    order,lo,hi=precursor_windows(pep_mass,precursor_tolerance)
+    vectors=binned_vectors(spectra_list,bin_width)
+    #each peak is also spread into the neighbouring bins so peaks either side of a bin edge still meet
+    spread=binned_vectors(spectra_list,bin_width,spread=True)[order]
+
+    for start in range(0,len(spectra_list),rows_per_block):
+        block_first=[]
+        block_second=[]
+        for rows,window_start,window_stop in _window_groups(pep_mass,lo,hi,start,start+rows_per_block,rows_per_block):
+            product=(vectors[rows]@spread[window_start:window_stop].T).tocoo()
+            first=rows[product.row]
+            second=order[product.col+window_start]
+
+            keep=(second>first)&(product.data+BOUND_SLACK>=cutoff)
+            first,second=first[keep],second[keep]
+            keep=numpy.abs(pep_mass[second]-pep_mass[first])<=precursor_tolerance
+            block_first.append(first[keep])
+            block_second.append(second[keep])
+
+        first=numpy.concatenate(block_first)
+        second=numpy.concatenate(block_second)
+        if len(first)>0:
+            order_pairs=numpy.lexsort((second,first))
+            yield first[order_pairs],second[order_pairs]
+
+def _window_groups(pep_mass,lo,hi,start,stop,max_waste):
+    """Takes the precursor masses and windows from precursor_windows and a range of list positions, and yields groups of the
+    positions in the range as (positions, window_start, window_stop), where the window is the range of the precursor mass
+    order holding the windows of every position in the group.
+    The positions are taken in precursor mass order, and a group is extended while its window is no longer than the windows
+    of its first and last positions added together, or than max_waste, so each group's window is never much more than the
+    spectra its positions need"""
+    stop=min(stop,len(pep_mass))
+    positions=numpy.arange(start,stop)
+    positions=positions[numpy.argsort(pep_mass[positions],kind='stable')]
+    group_lo=lo[positions].tolist()
+    group_hi=hi[positions].tolist()
+
+    first=0
+    for k in range(1,len(positions)+1):
+        if k<len(positions):
+            span=group_hi[k]-group_lo[first]
+            if span<=max(group_hi[first]-group_lo[first]+group_hi[k]-group_lo[k],max_waste):
                 continue
+        yield positions[first:k],group_lo[first],group_hi[k-1]
+        first=k
 
-            #add spectral match to dictionary
-            if spectrum_one not in matches:
-                matches[spectrum_one]={}
-            matches[spectrum_one][spectrum_two]={'cosine':score,'peaks':peak_count}
+def _prefilter_blocks(spectra_list,blocks,fragment_tolerance,cutoff):
+    """Takes a list of Spectrum objects and an iterable of blocks of pairs (first, second), and yields each block with only
+    the pairs whose approximate cosine is at least the cutoff, the same pairs prefilter_pairs would keep"""
+    bin_width=fragment_tolerance+SEARCH_SLACK
+    vectors=binned_vectors(spectra_list,bin_width)
+    spread=binned_vectors(spectra_list,bin_width,spread=True)
+    for first,second in blocks:
+        keep=approximate_cosines(vectors,spread,first,second)+BOUND_SLACK>=cutoff
+        yield first[keep],second[keep]
 
-            if spectrum_two not in matches:
-                matches[spectrum_two]={}
-            matches[spectrum_two][spectrum_one]={'cosine':score,'peaks':peak_count}
-            
-    return matches
+def approximate_cosines(vectors,spread,first,second):
+    """Takes the binned vectors of a list of spectra, without and with spread peaks (see binned_vectors), and two arrays of
+    list positions, and returns the binned approximate cosine of each pair (see prefilter_pairs)"""
+    scores=numpy.empty(len(first))
+    for start in range(0,len(first),BLOCK_SIZE):
+        block=slice(start,start+BLOCK_SIZE)
+        product=vectors[first[block]].multiply(spread[second[block]])
+        scores[block]=numpy.asarray(product.sum(axis=1)).ravel()
+    return scores
+
+def binned_vectors(spectra_list,bin_width,spread=False):
+    """Takes a list of Spectrum objects and returns a sparse CSR matrix with a row for each spectrum and a column for each
+    m/z bin of bin_width, holding the sum of the scaled intensities of the peaks in each bin.
+    With spread=True each peak is also added to the bins either side"""
+    mz=numpy.concatenate([S.mz for S in spectra_list]+[numpy.empty(0)])
+    scaled_intensity=numpy.concatenate([S.scaled_intensity for S in spectra_list]+[numpy.empty(0)])
+    rows=numpy.repeat(numpy.arange(len(spectra_list)),[len(S.mz) for S in spectra_list])
+
+    #bin 0 is left empty so there is always a bin below each peak
+    columns=(mz//bin_width).astype(numpy.int64)+1
+    n_bins=int(columns.max())+2 if len(columns) else 1
+
+    if spread:
+        rows=numpy.tile(rows,3)
+        columns=numpy.concatenate((columns-1,columns,columns+1))
+        scaled_intensity=numpy.tile(scaled_intensity,3)
+
+    #values for peaks in the same bin are summed
+    return sparse.csr_matrix((scaled_intensity,(rows,columns)),shape=(len(spectra_list),n_bins))
+
+def precursor_windows(pep_mass,precursor_tolerance):
+    """Takes an array of precursor masses and returns the order that sorts them, and for each spectrum the start and end
+    of the range of that order with precursor masses within precursor_tolerance (widened slightly for rounding)"""
+    order=numpy.argsort(pep_mass,kind='stable')
+    sorted_mass=pep_mass[order]
+    lo=numpy.searchsorted(sorted_mass,pep_mass-precursor_tolerance-SEARCH_SLACK,side='left')
+    hi=numpy.searchsorted(sorted_mass,pep_mass+precursor_tolerance+SEARCH_SLACK,side='right')
+    return order,lo,hi
 
 def cosine_score_greedy(spectrum_one, spectrum_two, fragment_tolerance=0.3, modified=False,precursor_tolerance=1.0):
     """Takes two MS2 Spectrum objects and returns the cosine similarity score and number of matched peaks.
@@ -59,49 +414,9 @@ def cosine_score_greedy(spectrum_one, spectrum_two, fragment_tolerance=0.3, modi
     if modified==False:
         modification=0
     
-    peak_pairs=[]
-
-    #make list of pairs of matched peaks within given tolerance
-    for peak1 in spectrum_one.peaks:
-        for peak2 in spectrum_two.peaks:
-
-            #check normal and modified peak masses
-            if (abs(peak1.mass-peak2.mass)<=fragment_tolerance) or (abs(peak1.mass+modification-peak2.mass) <= fragment_tolerance):
-                product=(peak1.scaled_intensity)*(peak2.scaled_intensity)
-                tuple = (peak1, peak2, product)
-                #add to list of peak pairs
-                peak_pairs.append(tuple)
-            
-
-    #sort matching peaks by descending intensity product
-    peak_pairs.sort(reverse=True,key=lambda tuple: tuple[2])
-    
-    #keep list of which peaks have been used from each spectrum
-    used_peaks_one=[]
-    used_peaks_two=[]
-
-    #reset total
-    total = 0
-    peak_count=0
+    peaks_one,peaks_two,products=peak_pairs(spectrum_one,spectrum_two,fragment_tolerance,modification)
 
-    #loop through list of peak pairs in decreasing order of intensity
-    for pair in peak_pairs:
-        #split tuple
-        peak_one=pair[0]
-        peak_two=pair[1]
-        product=pair[2]
-
-        if (peak_one not in used_peaks_one) and (peak_two not in used_peaks_two):
-            #sum intensity product if both peaks have not been used already
-            total+=product
-            #count number of matched peaks
-            peak_count +=1
-            
-            #add to the list of used peaks
-            used_peaks_one.append(peak_one)
-            used_peaks_two.append(peak_two)
-    
-    return total, peak_count
+    return greedy_matching(peaks_one,peaks_two,products)
 
 def cosine_score_max(spectrum_one, spectrum_two, fragment_tolerance=0.3, modified=False,precursor_tolerance=1.0):
     """Takes two MS2 Spectrum objects and returns the maximum cosine similarity score and number of matched peaks.
@@ -118,46 +433,170 @@ def cosine_score_max(spectrum_one, spectrum_two, fragment_tolerance=0.3, modifie
     if modified==False:
         modification=0
     
-    peak_pairs=[]
-
-    #make list of pairs of matched peaks within given tolerance
-    for peak1 in spectrum_one.peaks:
-        for peak2 in spectrum_two.peaks:
-
-            #check normal and modified peak masses
-            if (abs(peak1.mass-peak2.mass)<=fragment_tolerance) or (abs(peak1.mass+modification-peak2.mass) <= fragment_tolerance):
-                product=(peak1.scaled_intensity)*(peak2.scaled_intensity)
-                tuple = (peak1, peak2, product)
-                #add to list of peak pairs
-                peak_pairs.append(tuple)
+    peaks_one,peaks_two,products=peak_pairs(spectrum_one,spectrum_two,fragment_tolerance,modification)
+
+    return max_weight_matching(peaks_one,peaks_two,products)
+
+def peak_pairs(spectrum_one,spectrum_two,fragment_tolerance,modification):
+    """Takes two Spectrum objects, the fragment tolerance and the precursor mass difference to shift peaks by (0 for normal cosine).
+    Returns arrays of the peak positions in each spectrum and the scaled intensity products for every pair of peaks that
+    match within the tolerance, either directly or after shifting, in order of the first then second peak position.
+    Uses the sorted peak masses to find matching peaks instead of comparing every pair of peaks"""
+    mz_one=spectrum_one.mz
+    mz_two=spectrum_two.mz
+
+    if len(mz_one)==0 or len(mz_two)==0:
+        return numpy.empty(0,dtype=numpy.int64),numpy.empty(0,dtype=numpy.int64),numpy.empty(0)
+
+    #peak masses to look for in spectrum two: each peak of spectrum one, then each peak shifted by the modification
+    if modification==0:
+        shifted=mz_one
+    else:
+        shifted=numpy.concatenate((mz_one,mz_one+modification))
+
+    #range of peaks in spectrum two that could match each mass, widened slightly for rounding
+    #the exact tolerance check is done after
+    lo=mz_two.searchsorted(shifted-(fragment_tolerance+SEARCH_SLACK),side='left')
+    hi=mz_two.searchsorted(shifted+(fragment_tolerance+SEARCH_SLACK),side='right')
+    counts=hi-lo
+
+    #expand the ranges into one pair of positions per possible match
+    query=numpy.arange(len(shifted)).repeat(counts)
+    second=numpy.arange(len(query))-(counts.cumsum()-counts-lo).repeat(counts)
+    match=numpy.abs(shifted[query]-mz_two[second])<=fragment_tolerance
+    first=query[match]%len(mz_one)
+    second=second[match]
+
+    if modification!=0:
+        #pairs that match both directly and after shifting are only counted once
+        keys=numpy.unique(first*len(mz_two)+second)
+        first=keys//len(mz_two)
+        second=keys%len(mz_two)
+
+    products=spectrum_one.scaled_intensity[first]*spectrum_two.scaled_intensity[second]
+    return first,second,products
+
+def greedy_matching(peaks_one,peaks_two,products):
+    """Takes arrays of matched peak positions in two spectra and their intensity products, as returned by peak_pairs.
+    Returns the sum of products and number of peak pairs used when pairs are picked in decreasing order of product,
+    skipping pairs with a peak that has already been used"""
+    #sort matching peaks by descending intensity product, keeping pairs with equal products in peak order
+    order=numpy.argsort(-products,kind='stable')
     
-    #make graph containing the peaks in the two spectra
-    B=nx.Graph()
+    #keep track of which peaks have been used from each spectrum
+    used_peaks_one=set()
+    used_peaks_two=set()
+
+    #reset total
+    total = 0
+    peak_count=0
 
-    #add edges to graph
-    for p in peak_pairs:
-        B.add_edge(p[0],p[1],weight=p[2])    
+    #loop through peak pairs in decreasing order of intensity
+    for peak_one,peak_two,product in zip(peaks_one[order].tolist(),peaks_two[order].tolist(),products[order].tolist()):
+        if (peak_one not in used_peaks_one) and (peak_two not in used_peaks_two):
+            #sum intensity product if both peaks have not been used already
+            total+=product
+            #count number of matched peaks
+            peak_count +=1
+            
+            #add to the used peaks
+            used_peaks_one.add(peak_one)
+            used_peaks_two.add(peak_two)
     
-    #maximum weighted score
-    matching=nx.algorithms.max_weight_matching(B)
+    return total, peak_count
+
+def could_pass(peaks_one,peaks_two,products,cosine_threshold=None,peak_threshold=None):
+    """Takes arrays of matched peak positions in two spectra and their intensity products, as returned by peak_pairs.
+    Uses cheap upper bounds on the number of matched peaks and on the score to check if the pair of spectra could pass
+    the thresholds. Returns False only when no choice of peak pairs can reach both thresholds"""
+    if peak_threshold is not None:
+        #each peak can only be used once, so no more peaks can match than are in any pair in either spectrum
+        if len(products)<peak_threshold:
+            return False
+        distinct_one=1+numpy.count_nonzero(peaks_one[1:]!=peaks_one[:-1]) #peaks_one is sorted
+        if min(distinct_one,len(numpy.unique(peaks_two)))<peak_threshold:
+            return False
+
+    if cosine_threshold is not None and len(products)>0:
+        #each peak can only be used once, so the score is at most the sum of the best product of each peak in either spectrum
+        best_one=numpy.maximum.reduceat(products,numpy.flatnonzero(numpy.r_[True,peaks_one[1:]!=peaks_one[:-1]]))
+        best_two=numpy.zeros(peaks_two.max()+1)
+        numpy.maximum.at(best_two,peaks_two,products)
+        if min(best_one.sum(),best_two.sum())+BOUND_SLACK<cosine_threshold:
+            return False
 
-    #number of peaks matched between the two spectra
-    peak_count=len(matching)
+    elif cosine_threshold is not None and cosine_threshold>0:
+        return False
+
+    return True
+
+def max_weight_matching(peaks_one,peaks_two,products):
+    """Takes arrays of matched peak positions in two spectra and their intensity products, as returned by peak_pairs.
+    Returns the highest possible sum of products using each peak at most once, and the number of peak pairs used.
+    When several sets of pairs have the highest sum (within a fraction TIE_TOLERANCE of it), the most pairs are used.
+    The peak pairs are split into connected groups which are each solved separately as an assignment problem"""
+    first=peaks_one.tolist()
+    second=peaks_two.tolist()
+    weights=products.tolist()
+
+    #join peaks connected by pairs into groups with union-find, with spectrum two peaks stored as negative numbers
+    parent={}
+    def find(peak):
+        while parent.setdefault(peak,peak)!=peak:
+            parent[peak]=parent[parent[peak]]
+            peak=parent[peak]
+        return peak
+
+    for i,j in zip(first,second):
+        root_one=find(i)
+        root_two=find(~j)
+        if root_one!=root_two:
+            parent[root_one]=root_two
+
+    groups={}
+    for k,i in enumerate(first):
+        groups.setdefault(find(i),[]).append(k)
 
     total=0
-    #sum the intensity products for the matched peaks
-    for m in matching:
-        for p in peak_pairs:
-            if (m[0]==p[0] and m[1]==p[1]) or (m[0]==p[1] and m[1]==p[0]):
-                total+=p[2]
+    peak_count=0
+    for pairs in groups.values():
+        rows=sorted({first[k] for k in pairs})
+        columns=sorted({second[k] for k in pairs})
+
+        if len(rows)==1 or len(columns)==1:
+            #every pair in the group shares one peak, so only the highest product can be used
+            weight=max(weights[k] for k in pairs)
+            total+=weight
+            peak_count+=int(weight!=0)
+            continue
+
+        #otherwise solve with the Hungarian algorithm on a matrix of just the peaks in the group
+        row_position={peak:n for n,peak in enumerate(rows)}
+        column_position={peak:n for n,peak in enumerate(columns)}
+        matrix=numpy.zeros((len(rows),len(columns)))
+        for k in pairs:
+            matrix[row_position[first[k]],column_position[second[k]]]=weights[k]
+
+        #a small bonus for each pair used, so of the matchings with the highest weight the one with most pairs is found
+        bonus=numpy.where(matrix>0,TIE_TOLERANCE*matrix.max()/min(matrix.shape),0)
+        assigned_rows,assigned_columns=linear_sum_assignment(matrix+bonus,maximize=True)
+
+        #peaks assigned to each other without being a pair have a weight of 0 and aren't counted
+        matched=matrix[assigned_rows,assigned_columns]
+        total+=float(matched.sum())
+        peak_count+=int(numpy.count_nonzero(matched))
 
     return total,peak_count
-      
+
 def filter_pairs(pairs,cosine_threshold=0.7,peak_threshold=6):
     """Takes a dictionary of spectra matches and removes any matches below given cosine and n peaks thresholds
     Default score threshold = 0.7
     Default peaks threshold = 6
+    An EdgeTable is filtered without making a dictionary, and a filtered EdgeTable is returned
     """
+    if isinstance(pairs,EdgeTable):
+        return pairs.filter(cosine_threshold,peak_threshold)
+
     for spectrum in pairs:
         
         #only keep spectral matches if they pass the thresholds
@@ -174,25 +613,129 @@ def filter_pairs(pairs,cosine_threshold=0.7,peak_threshold=6):
             
     return filtered_pairs
 
-def library_match(spectra_list,lib_mgf,precursor_tol=1.0,cosine=0.7,n_peaks=3):
+def library_match(spectra_list,lib_mgf,precursor_tol=1.0,cosine=0.7,n_peaks=3,cache=True,top_k=1,workers=1,
+                  analog=False,max_mass_difference=None,shard_size=None):
     """Reads a given library mgf file and matches the given spectra to the library spectra using normal cosine.
-    Each test spectra is given the name of the library spectra match with the highest cosine score."""
-    library=mgf.read_mgf(lib_mgf)
-    library_sort=sorted(library)
-
-    for test_spectra in spectra_list:
-        #find position where test spectrum would go in library list by precursor mass
-        pos=bisect.bisect(library_sort,test_spectra)
-        matches=[]
-        #calculate scores for positions above and below insertion point
-        for lib in library_sort[pos-2:pos+2]:
-            score,peaks=cosine_score_max(test_spectra,lib,modified=False,precursor_tolerance=precursor_tol)
-            if score>=cosine and peaks>=n_peaks:
-                matches.append((score,peaks,lib))
-        
-        if len(matches)>0:
-            #sort possible library matches by cosine score
-            matches.sort(reverse=True,key=lambda tuple: tuple[0])
+    Each test spectra is given the name of the library spectra match with the highest cosine score.
+    The top_k best matches are also kept in the library_hits of each spectrum (see library_search).
+    Use analog=True to search for modified analogs with modified cosine instead (see library_search).
+    If cache is True, the library is loaded from the files saved next to the library mgf file when they exist, and saved
+    there otherwise; with cache False they are neither read nor written.
+    Give shard_size to search a library too large for memory in shards (see library_search)."""
+    hits=library_search(spectra_list,lib_mgf,precursor_tol,cosine,n_peaks,top_k,workers,cache,analog=analog,
+        max_mass_difference=max_mass_difference,shard_size=shard_size)
+
+    for test_spectra,spectrum_hits in zip(spectra_list,hits):
+        if len(spectrum_hits)>0:
             #use parameters of spectrum match with highest cosine score
-            test_spectra.library_parameters=matches[0][2].parameters
-            
+            test_spectra.library_parameters=spectrum_hits[0]['parameters']
+            test_spectra.library_hits=spectrum_hits
+
+def library_search(spectra_list,lib_mgf,precursor_tol=1.0,cosine=0.7,n_peaks=3,top_k=1,workers=1,cache=True,
+                   fragment_tolerance=0.3,analog=False,max_mass_difference=None,analog_candidates=ANALOG_CANDIDATES,
+                   shard_size=None):
+    """Takes a list of Spectrum objects and a library mgf file, and returns a list with the top_k library matches of each
+    spectrum, highest cosine first (ties in order of library precursor mass), as dictionaries with the cosine score,
+    number of matching peaks and the library spectrum's parameters. Matches need at least cosine and n_peaks.
+    Every library spectrum within precursor_tol that could have n_peaks matching peaks is scored (see SpectralLibrary).
+    Use workers to search batches of spectra with a pool of processes. The library is built once and saved (to a temporary
+    directory if cache is False), and each process memory maps the saved files read-only, so the library is never built
+    again or copied to every process.
+    With analog=True, library spectra with any precursor mass (or within max_mass_difference) are searched with modified
+    cosine, and precursor_tol is not used. Only the analog_candidates library spectra sharing the most fragments or
+    neutral losses with each spectrum are scored (see SpectralLibrary.analog_candidates).
+    Give shard_size to split the library into shards of that many spectra by precursor mass (see ShardedLibrary), so only
+    the shards in each spectrum's precursor window are mapped into memory. The shards are always saved, and in analog
+    search analog_candidates are scored from each shard."""
+    library=_open_library(lib_mgf,cache,shard_size)
+    options=(precursor_tol,cosine,n_peaks,top_k,fragment_tolerance,analog,max_mass_difference,analog_candidates)
+
+    if workers==1:
+        return _search_library(library,spectra_list,*options)
+
+    found=[]
+    batches=(mgf_cache.pack_spectra(spectra_list[k:k+QUERIES_PER_BATCH]) for k in range(0,len(spectra_list),QUERIES_PER_BATCH))
+    with tempfile.TemporaryDirectory(prefix='msmolnet-library-') as temporary:
+        directory=_saved_library(library,lib_mgf,cache,temporary)
+        with ProcessPoolExecutor(max_workers=workers,initializer=_attach_library,initargs=(lib_mgf,directory,shard_size)) as executor:
+            for batch in executor.map(_search_batch,batches,itertools.repeat(options)):
+                found.extend(batch)
+    return found
+
+def _search_library(library,queries,precursor_tol,cosine,n_peaks,top_k,fragment_tolerance,analog,max_mass_difference,
+                    analog_candidates):
+    """Takes a SpectralLibrary or ShardedLibrary and a list of Spectrum objects and returns the top_k matches of each
+    spectrum, as in library_search"""
+    found=[]
+    for query in queries:
+        if not analog:
+            window=precursor_tol+SEARCH_SLACK
+        elif max_mass_difference is not None:
+            window=max_mass_difference+SEARCH_SLACK
+        else:
+            window=numpy.inf
+
+        hits=[]
+        for shard in library.libraries(query.pep_mass-window,query.pep_mass+window):
+            if analog:
+                candidates=shard.analog_candidates(query,None if window==numpy.inf else window,fragment_tolerance,n_peaks,
+                    analog_candidates)
+            else:
+                candidates=shard.candidates(query,window,fragment_tolerance,n_peaks)
+
+            for position in candidates.tolist():
+                lib=shard[position]
+                modification=lib.pep_mass-query.pep_mass
+                if analog:
+                    if max_mass_difference is not None and abs(modification)>max_mass_difference:
+                        continue
+                elif abs(modification)>precursor_tol:
+                    continue
+                else:
+                    modification=0
+
+                pairs=peak_pairs(query,lib,fragment_tolerance,modification)
+                if not could_pass(*pairs,cosine,n_peaks):
+                    continue
+                score,peaks=max_weight_matching(*pairs)
+                if score>=cosine and peaks>=n_peaks:
+                    hits.append({'cosine':score,'peaks':peaks,'parameters':lib.parameters})
+
+        #sort possible library matches by cosine score
+        hits.sort(reverse=True,key=lambda hit: hit['cosine'])
+        found.append(hits[:top_k])
+    return found
+
+def _open_library(lib_mgf,cache,shard_size):
+    """Open a library mgf file as a SpectralLibrary, or a ShardedLibrary if shard_size is given
+    """
+    if shard_size is None:
+        return SpectralLibrary(lib_mgf,save=cache,load=cache)
+    return ShardedLibrary(lib_mgf,shard_size)
+
+def _saved_library(library,lib_mgf,cache,temporary):
+    """Returns the directory the pool processes memory map an open library from: the shards or library saved next to the
+    mgf file when they are up to date, otherwise the temporary directory the library is saved to"""
+    if isinstance(library,ShardedLibrary):
+        return library.library_path()
+    if cache and SpectralLibrary.from_directory(library.library_path(),lib_mgf) is not None:
+        return library.library_path()
+    if not library.save(temporary):
+        raise OSError(f"Could not write library to {temporary}")
+    return temporary
+
+def _attach_library(lib_mgf,directory,shard_size):
+    """Process pool initializer: memory map the library saved by the parent process, without building it
+    """
+    global _worker_library
+    if shard_size is not None:
+        _worker_library=ShardedLibrary(lib_mgf,shard_size,build=False)
+        return
+    _worker_library=SpectralLibrary.from_directory(directory,lib_mgf)
+    if _worker_library is None:
+        raise OSError(f"Library in {directory} is missing or out of date")
+
+def _search_batch(packed,options):
+    """Search a batch of packed query spectra in a pool process
+    """
+    return _search_library(_worker_library,mgf_cache.unpack_spectra(packed),*options)
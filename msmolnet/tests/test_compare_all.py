@@ -0,0 +1,199 @@
+"""Method to test comparing every spectrum in a list with every other spectrum
+"""
+
+from msmolnet import similarity
+from msmolnet import Spectrum
+from msmolnet import ScoreCache
+from msmolnet import network
+from msmolnet.EdgeTable import EdgeTable
+import random
+import numpy
+
+def random_spectra(n):
+    """List of spectra with peaks on a 0.5 grid so that many pairs share peaks
+    """
+    spectra_list=[]
+    for k in range(n):
+        spectrum=Spectrum.Spectrum()
+        for mass in random.sample(range(100,400),random.randint(1,30)):
+            spectrum.add_peak(mass/2,random.uniform(1,100))
+        spectrum.pep_mass=random.choice([200,200.5,210,250,300])+random.uniform(0,5)
+        spectrum.parameters={'SCANS':str(k)}
+        spectrum.set_id()
+        spectrum.euclidean_scale()
+        spectra_list.append(spectrum)
+    return spectra_list
+
+def reference_compare_all(spectra_list,**options):
+    """Score every pair of spectra in the list
+    """
+    matches={}
+    for i in range(len(spectra_list)):
+        for j in range(i+1,len(spectra_list)):
+            S1,S2=spectra_list[i],spectra_list[j]
+            if options['greedy']:
+                score,peaks=similarity.cosine_score_greedy(S1,S2,options['fragment_tolerance'],options['modified'],options['precursor_tolerance'])
+            else:
+                score,peaks=similarity.cosine_score_max(S1,S2,options['fragment_tolerance'],options['modified'],options['precursor_tolerance'])
+            if score==0 and peaks==0:
+                continue
+            matches.setdefault(S1,{})[S2]={'cosine':score,'peaks':peaks}
+            matches.setdefault(S2,{})[S1]={'cosine':score,'peaks':peaks}
+    return matches
+
+def as_list(matches):
+    """Nested dictionary of matches as a list, keeping the dictionary order
+    """
+    return [(S1.feature_id,S2.feature_id,match) for S1 in matches for S2,match in matches[S1].items()]
+
+def test_compare_all():
+    """Tests that compare_all gives the same matches, in the same order, as scoring every pair of spectra.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(3)
+    spectra_list=random_spectra(60)
+
+    for options in [{'fragment_tolerance':0.3,'modified':False,'precursor_tolerance':1.0,'greedy':False},
+                    {'fragment_tolerance':0.3,'modified':True,'precursor_tolerance':20.0,'greedy':True}]:
+        expected=as_list(reference_compare_all(spectra_list,**options))
+        assert len(expected)>0, "No matches to compare"
+        assert as_list(similarity.compare_all(spectra_list,**options))==expected, "Incorrect matches"
+
+def test_compare_all_workers():
+    """Tests that scoring pairs with a pool of processes gives the same matches, in the same order, as one process.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(4)
+    spectra_list=random_spectra(80)
+
+    expected=as_list(similarity.compare_all(spectra_list,modified=True,precursor_tolerance=20.0))
+    for workers in [2,3]:
+        assert as_list(similarity.compare_all(spectra_list,modified=True,precursor_tolerance=20.0,workers=workers))==expected, "Incorrect matches"
+
+def test_compare_all_thresholds():
+    """Tests that giving thresholds to compare_all keeps the same matches as filtering all the matches after.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(5)
+    spectra_list=random_spectra(80)
+
+    for greedy in [False,True]:
+        options={'modified':True,'precursor_tolerance':20.0,'greedy':greedy}
+        expected=similarity.filter_pairs(similarity.compare_all(spectra_list,**options),cosine_threshold=0.4,peak_threshold=3)
+        matches=similarity.compare_all(spectra_list,cosine_threshold=0.4,peak_threshold=3,**options)
+        assert len(expected)>0, "No matches to compare"
+        assert sorted(as_list(matches))==sorted(as_list(expected)), "Incorrect matches"
+
+def test_compare_all_prefilter():
+    """Tests that the binned approximate cosine prefilter doesn't lose any unmodified cosine matches above the cutoff.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(6)
+    spectra_list=random_spectra(80)
+
+    options={'modified':False,'precursor_tolerance':100.0,'cosine_threshold':0.2,'peak_threshold':2}
+    expected=as_list(similarity.compare_all(spectra_list,**options))
+    candidates=sum(len(first) for first,second in similarity.prefilter_pairs(spectra_list,0.3,100.0,0.2))
+
+    assert len(expected)>0, "No matches to compare"
+    assert candidates<len(spectra_list)*(len(spectra_list)-1)/2, "No pairs removed by prefilter"
+    assert as_list(similarity.compare_all(spectra_list,prefilter=0.2,**options))==expected, "Incorrect matches"
+
+def test_prefilter_common_bins():
+    """Tests that multiplying only the spectra in each precursor window gives the same prefiltered pairs, in the same order,
+    as multiplying every pair, for spectra that all share peaks in a few common bins and have a wide range of precursor masses.
+    Throws an assertion error if the pairs are different
+    """
+    random.seed(11)
+    spectra_list=random_spectra(150)
+    for spectrum in spectra_list:
+        spectrum.set_peaks(numpy.concatenate((spectrum.mz,[41.05,55.06,69.07])),numpy.concatenate((spectrum.intensity,[50.0]*3)))
+        spectrum.pep_mass=random.uniform(200,1200)
+        spectrum.euclidean_scale()
+
+    #every pair of spectra has a product from the common bins
+    vectors=similarity.binned_vectors(spectra_list,0.3+similarity.SEARCH_SLACK)
+    spread=similarity.binned_vectors(spectra_list,0.3+similarity.SEARCH_SLACK,spread=True)
+    approximate=(vectors@spread.T).toarray()
+    pep_mass=numpy.array([S.pep_mass for S in spectra_list])
+    expected=[(i,j) for i in range(len(spectra_list)) for j in range(i+1,len(spectra_list))
+        if abs(pep_mass[i]-pep_mass[j])<=20.0 and approximate[i,j]+similarity.BOUND_SLACK>=0.1]
+    assert numpy.all(approximate>0), "Spectra don't share bins"
+    assert len(expected)>0, "No pairs to compare"
+
+    for rows_per_block in [7,1000]:
+        pairs=[pair for first,second in similarity.prefilter_pairs(spectra_list,0.3,20.0,0.1,rows_per_block=rows_per_block)
+            for pair in zip(first.tolist(),second.tolist())]
+        assert pairs==expected, "Incorrect prefiltered pairs"
+
+def test_compare_all_score_cache(tmp_path):
+    """Tests that reusing saved scores gives the same matches, in the same order, as scoring every pair, also with other
+    thresholds, and that only the pairs with new spectra are saved when spectra are added.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(7)
+    spectra_list=random_spectra(60)
+    options={'modified':True,'precursor_tolerance':20.0,'cosine_threshold':0.2}
+
+    with ScoreCache.ScoreCache(tmp_path/"scores.sqlite") as score_cache:
+        expected=as_list(similarity.compare_all(spectra_list,**options))
+        assert as_list(similarity.compare_all(spectra_list,score_cache=score_cache,**options))==expected, "Incorrect matches"
+        saved=len(score_cache)
+        assert saved>0, "No scores saved"
+
+        assert as_list(similarity.compare_all(spectra_list,score_cache=score_cache,workers=2,**options))==expected, "Incorrect saved matches"
+        assert len(score_cache)==saved, "Pairs scored again"
+
+        for thresholds in [{'cosine_threshold':0.5,'peak_threshold':4},{'cosine_threshold':None}]:
+            changed=dict(options,**thresholds)
+            expected_changed=as_list(similarity.compare_all(spectra_list,**changed))
+            assert as_list(similarity.compare_all(spectra_list,score_cache=score_cache,**changed))==expected_changed, "Incorrect matches with other thresholds"
+            assert len(score_cache)==saved, "Pairs scored again with other thresholds"
+
+        added=spectra_list[:30]+random_spectra(10)+spectra_list[30:]
+        expected=as_list(similarity.compare_all(added,**options))
+        assert as_list(similarity.compare_all(added,score_cache=score_cache,**options))==expected, "Incorrect matches with new spectra"
+        new_pairs=sum(len(first) for first,second in similarity.candidate_pairs(added,20.0))-saved
+        assert len(score_cache)==saved+new_pairs, "Incorrect number of pairs scored"
+
+def test_compare_all_table():
+    """Tests that the edge table from compare_all gives the same matches, filtered matches and network as the dictionary.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(10)
+    spectra_list=random_spectra(80)
+    options={'modified':True,'precursor_tolerance':20.0}
+
+    matches=similarity.compare_all(spectra_list,**options)
+    table=similarity.compare_all(spectra_list,as_table=True,**options)
+    assert len(table)*2==len(as_list(matches)), "Incorrect number of matches"
+    assert as_list(table.to_dict())==as_list(matches), "Incorrect matches"
+    assert as_list(EdgeTable.from_dict(spectra_list,matches).to_dict())==as_list(matches), "Incorrect matches from dictionary"
+
+    filtered=similarity.filter_pairs(table,cosine_threshold=0.3,peak_threshold=3)
+    expected=similarity.filter_pairs(matches,cosine_threshold=0.3,peak_threshold=3)
+    assert len(filtered)>0 and sorted(as_list(filtered.to_dict()))==sorted(as_list(expected)), "Incorrect filtered matches"
+
+    expected=network.make_network(spectra_list,similarity.compare_all(spectra_list,cosine_threshold=0.3,peak_threshold=3,**options))
+    graph=network.make_network(spectra_list,filtered)
+    assert list(graph.nodes(data=True))==list(expected.nodes(data=True)), "Incorrect nodes"
+    assert [list(graph.adj[N].items()) for N in graph]==[list(expected.adj[N].items()) for N in expected], "Incorrect edges"
+
+def test_iter_matches(tmp_path):
+    """Tests that streaming the matches that pass the thresholds, and writing them to a file, gives the same matches as
+    compare_all with the thresholds.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(11)
+    spectra_list=random_spectra(80)
+    options={'modified':True,'precursor_tolerance':20.0,'cosine_threshold':0.3,'peak_threshold':3}
+
+    table=similarity.compare_all(spectra_list,as_table=True,**options)
+    expected=list(zip(table.edges['i'].tolist(),table.edges['j'].tolist(),table.edges['cosine'].tolist(),table.edges['peaks'].tolist()))
+    assert len(expected)>0, "No matches to compare"
+    assert list(similarity.iter_matches(spectra_list,workers=2,**options))==expected, "Incorrect streamed matches"
+
+    file_path=tmp_path/"edges.bin"
+    assert similarity.write_matches(file_path,spectra_list,**options)==len(expected), "Incorrect number of matches written"
+    written=EdgeTable.from_file(spectra_list,file_path)
+    assert as_list(written.to_dict())==as_list(table.to_dict()), "Incorrect matches written"
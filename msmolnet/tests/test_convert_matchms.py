@@ -2,6 +2,8 @@
 """
 
 from msmolnet.use_matchms import convert_matches as convert
+from msmolnet.SpectralNetwork import SpectralNetwork
+from msmolnet import similarity
 
 import numpy as np
 import matchms
@@ -18,4 +20,25 @@ def test_convert_spectra():
     new_spectrum=convert.convert_spectrum(spectrum)
 
     assert new_spectrum.peaks[0].mass==100 and new_spectrum.peaks[0].intensity==0.7, "incorrect peak"
-    assert new_spectrum.feature_id=='1', "incorrect ID"
\ No newline at end of file
+    assert new_spectrum.feature_id=='1', "incorrect ID"
+
+
+def test_match_spectra():
+    """Tests that matches keyed by scans numbers, as convert_scores returns them, make a network of the converted spectra
+    """
+    spectra_list=[]
+    for k in range(4):
+        spectrum = Spectrum(mz=np.array([100, 150, 200.+k]),
+                    intensities=np.array([0.7, 0.2, 0.1]),
+                    metadata={'scans': str(k)})
+        spectra_list.append(convert.convert_spectrum(spectrum))
+
+    matches={}
+    for one,two,score,peaks in [('0','1',0.9,3),('1','2',0.8,2),('0','3',0.3,1)]:
+        matches.setdefault(one,{})[two]={'cosine':score,'peaks':peaks}
+        matches.setdefault(two,{})[one]={'cosine':score,'peaks':peaks}
+
+    matches=similarity.filter_pairs(convert.match_spectra(matches,spectra_list),cosine_threshold=0.5,peak_threshold=2)
+    molecular_network=SpectralNetwork(spectra_list,matches)
+    edges={(str(spectra_list[i]),str(spectra_list[j])) for i,j in molecular_network.table.edges[['i','j']].tolist()}
+    assert edges=={('0','1'),('1','2')}, "incorrect network edges"
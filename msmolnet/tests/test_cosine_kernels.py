@@ -0,0 +1,86 @@
+"""Method to test the fast cosine scoring kernels against a simple comparison of every pair of peaks
+"""
+
+from msmolnet import similarity
+from msmolnet import Spectrum
+import networkx as nx
+import random
+import numpy
+import math
+
+def reference_pairs(spectrum_one,spectrum_two,fragment_tolerance,modification):
+    """Compare every peak of one spectrum with every peak of the other
+    """
+    pairs=[]
+    for peak1,peak2 in [(p1,p2) for p1 in enumerate(spectrum_one.peaks) for p2 in enumerate(spectrum_two.peaks)]:
+        (i,P1),(j,P2)=peak1,peak2
+        if (abs(P1.mass-P2.mass)<=fragment_tolerance) or (abs(P1.mass+modification-P2.mass)<=fragment_tolerance):
+            pairs.append((i,j,P1.scaled_intensity*P2.scaled_intensity))
+    return pairs
+
+def reference_greedy(spectrum_one,spectrum_two,fragment_tolerance,modification):
+    """Greedy score using the simple pair comparison
+    """
+    pairs=reference_pairs(spectrum_one,spectrum_two,fragment_tolerance,modification)
+    pairs.sort(reverse=True,key=lambda tuple: tuple[2])
+    used_one,used_two=set(),set()
+    total,count=0,0
+    for i,j,product in pairs:
+        if i not in used_one and j not in used_two:
+            total+=product
+            count+=1
+            used_one.add(i)
+            used_two.add(j)
+    return total,count
+
+def reference_max(spectrum_one,spectrum_two,fragment_tolerance,modification):
+    """Maximum weighted score using the simple pair comparison and networkx matching. The weights are made integers
+    that rank matchings by weight, then by number of pairs, so of tied matchings the one with most pairs is found"""
+    pairs=reference_pairs(spectrum_one,spectrum_two,fragment_tolerance,modification)
+    B=nx.Graph()
+    for i,j,product in pairs:
+        B.add_edge((1,i),(2,j),weight=round(product*1e9)*(len(pairs)+1)+1,product=product)
+    matching=nx.algorithms.max_weight_matching(B)
+    return sum(B.edges[m]['product'] for m in matching),len(matching)
+
+def random_spectrum(pep_mass,intensities=None):
+    """Spectrum with peaks on a 0.1 grid so that many pairs are exactly at the tolerance
+    """
+    spectrum=Spectrum.Spectrum()
+    for mass in random.sample(range(500,1500),random.randint(0,40)):
+        spectrum.add_peak(mass/10,random.choice(intensities or [1,4,9,16,random.uniform(1,100)]))
+    spectrum.pep_mass=pep_mass
+    spectrum.euclidean_scale()
+    return spectrum
+
+def test_cosine_kernels():
+    """Tests that the greedy kernel gives exactly the same score and number of peaks as comparing every pair of peaks,
+    and that the maximum weighted kernel gives the same score and number of peaks as networkx matching, including
+    spectra with many tied intensity products.
+    Throws an assertion error if a score is different
+    """
+    random.seed(1)
+    for trial in range(400):
+        #equal intensities make every product tie
+        intensities=[1] if trial%4==0 else [1,4] if trial%4==1 else None
+        S1=random_spectrum(random.choice([100,110.5,120.2]),intensities)
+        S2=random_spectrum(random.choice([100,110.5,120.2]),intensities)
+        modified=random.choice([True,False])
+        modification=S2.pep_mass-S1.pep_mass if modified else 0
+
+        expected=reference_greedy(S1,S2,0.3,modification)
+        assert similarity.cosine_score_greedy(S1,S2,0.3,modified,precursor_tolerance=50)==expected, "Incorrect greedy score"
+
+        expected,expected_peaks=reference_max(S1,S2,0.3,modification)
+        score,peaks=similarity.cosine_score_max(S1,S2,0.3,modified,precursor_tolerance=50)
+        assert math.isclose(score,expected,abs_tol=1e-12), "Incorrect maximum weighted score"
+        assert peaks==expected_peaks, "Incorrect number of maximum weighted peaks"
+
+def test_max_weight_matching_ties():
+    """Tests that of two matchings with the same weight, one pair of weight 2 or two pairs of weight 1, the matching with
+    more pairs is used.
+    Throws an assertion error if the number of pairs is different
+    """
+    for peaks_one,peaks_two,products in (([0,0,1],[0,1,0],[2.0,1.0,1.0]),([1,0,0],[0,1,0],[1.0,1.0,2.0])):
+        result=similarity.max_weight_matching(numpy.array(peaks_one),numpy.array(peaks_two),numpy.array(products))
+        assert result==(2.0,2), "Incorrect tied matching"
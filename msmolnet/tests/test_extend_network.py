@@ -0,0 +1,55 @@
+"""Method to test adding new spectra to an existing molecular network
+"""
+
+from msmolnet import network
+from msmolnet import similarity
+from msmolnet import Spectrum
+import networkx as nx
+import random
+
+def random_spectra(n):
+    """List of spectra with peaks on a 0.5 grid so that many pairs share peaks
+    """
+    spectra_list=[]
+    for k in range(n):
+        spectrum=Spectrum.Spectrum()
+        for mass in random.sample(range(100,400),random.randint(1,30)):
+            spectrum.add_peak(mass/2,random.uniform(1,100))
+        spectrum.pep_mass=random.choice([200,200.5,210,250,300])+random.uniform(0,5)
+        spectrum.parameters={'SCANS':str(k)}
+        spectrum.set_id()
+        spectrum.euclidean_scale()
+        spectra_list.append(spectrum)
+    return spectra_list
+
+def edge_set(graph):
+    """Edges of a network as a set of feature ID pairs with their cosine score and number of peaks
+    """
+    return {(frozenset((N.feature_id,P.feature_id)),match['cosine'],match['peaks']) for N,P,match in graph.edges(data=True)}
+
+def test_extend_network():
+    """Tests that extending a network with new spectra gives the same network as making it from all the spectra, and that
+    the families with new spectra are filtered.
+    Throws an assertion error if the network is not correct
+    """
+    random.seed(9)
+    spectra_list=random_spectra(80)
+    existing,new=spectra_list[:50],spectra_list[50:]
+    options={'modified':True,'precursor_tolerance':20.0,'cosine_threshold':0.2,'peak_threshold':2}
+
+    graph=network.make_network(existing,similarity.compare_all(existing,**options))
+    graph,all_spectra=network.extend_network(graph,existing,new,n_neighbours=1000,family_size=1000,**options)
+    expected=network.make_network(spectra_list,similarity.compare_all(spectra_list,**options))
+
+    assert all_spectra==spectra_list, "Incorrect spectra"
+    assert set(graph.nodes)==set(expected.nodes), "Incorrect nodes"
+    assert graph.nodes[new[0]]==expected.nodes[new[0]], "Incorrect node metadata"
+    assert len(expected.edges)>0 and edge_set(graph)==edge_set(expected), "Incorrect edges"
+
+    #only the families with new spectra are filtered
+    added=random_spectra(5)
+    graph,_=network.extend_network(graph,spectra_list,added,n_neighbours=2,family_size=5,**options)
+    for A in added:
+        family=nx.node_connected_component(graph,A)
+        assert len(family)<=5 and all(graph.degree(N)<=2 for N in family), "Family not filtered"
+    assert any(graph.degree(N)>2 for N in graph), "Other families filtered"
@@ -3,6 +3,7 @@
 
 from msmolnet import network
 import networkx as nx
+import random
 
 def test_filter_family():
     """Tests the network molecular family size filtering method.
@@ -18,3 +19,49 @@ def test_filter_family():
 
     assert family == [1,2,3], "Incorrect family"
 
+
+def legacy_filter_family(graph, M, nodes=None):
+    """Family size filtering that removes one edge at a time and checks for a path after each, to compare with
+    """
+    if nodes is None:
+        nodes=list(nx.nodes(graph))
+
+    used=[]
+    for node in nodes:
+        if node in used:
+            continue
+
+        while True:
+            family=nx.node_connected_component(graph,node)
+
+            if len(family)>M:
+                edges = sorted(graph.edges(family,data=True), key=lambda x: x[2]['cosine'],reverse=True)
+                while True:
+                    remove=edges[-1]
+                    edges=edges[:-1]
+                    graph.remove_edge(remove[0],remove[1])
+                    if not nx.has_path(graph,remove[0],remove[1]):
+                        break
+                continue
+
+            for F in family:
+                used.append(F)
+            break
+
+    return graph
+
+def test_filter_family_random():
+    """Tests that family size filtering removes the same edges as removing one edge at a time, on random networks with
+    and without a list of nodes to filter.
+    Throws an assertion error if the filtered networks are different
+    """
+    rng=random.Random(21)
+    for trial in range(40):
+        n=rng.randint(5,60)
+        edges=[(one,two,{'cosine':rng.random()}) for one in range(n) for two in range(one+1,n) if rng.random()<rng.uniform(0.02,0.3)]
+        M=rng.randint(1,15)
+        nodes=None if trial%2==0 else rng.sample(range(n),rng.randint(1,n))
+
+        expected=legacy_filter_family(network.make_network(range(n),edges),M,nodes)
+        filtered=network.filter_family(network.make_network(range(n),edges),M,nodes)
+        assert set(map(frozenset,filtered.edges()))==set(map(frozenset,expected.edges())), "Incorrect edges removed"
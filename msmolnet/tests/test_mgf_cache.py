@@ -0,0 +1,47 @@
+"""Method to test the binary spectrum cache written next to mgf files
+"""
+
+from msmolnet import read_mgf
+from msmolnet import mgf_cache
+import numpy as np
+import os
+
+MGF="""BEGIN IONS
+PEPMASS=250.1
+SCANS=1
+50.7 234
+54.6 585
+60.7 773
+END IONS
+BEGIN IONS
+SCANS=2
+65.6 387
+87.7 546
+END IONS
+BEGIN IONS
+PEPMASS=300.2
+SCANS=3
+END IONS
+"""
+
+def test_mgf_cache(tmp_path):
+    """Tests that spectra loaded from the cache are the same as the parsed spectra, and that a changed file is parsed again.
+    Throws an assertion error if the cache is not correct
+    """
+    file_path=tmp_path/"test.mgf"
+    file_path.write_text(MGF)
+
+    parsed=read_mgf.read_mgf(file_path)
+    assert os.path.isdir(mgf_cache.cache_path(file_path)), "Cache not written"
+
+    cached=mgf_cache.load_cache(file_path)
+    assert isinstance(cached[0].mz.base,np.memmap), "Cache not memory mapped"
+    for S1,S2 in zip(parsed,cached):
+        assert S1.feature_id==S2.feature_id and S1.parameters==S2.parameters, "Incorrect metadata"
+        assert getattr(S1,'pep_mass',None)==getattr(S2,'pep_mass',None), "Incorrect precursor mass"
+        assert np.array_equal(S1.mz,S2.mz) and np.array_equal(S1.scaled_intensity,S2.scaled_intensity), "Incorrect peaks"
+
+    #cache is ignored once the file changes
+    file_path.write_text(MGF.replace("SCANS=3","SCANS=30"))
+    assert mgf_cache.load_cache(file_path) is None, "Out of date cache was used"
+    assert read_mgf.read_mgf(file_path)[2].feature_id=='30', "File not parsed again after changing"
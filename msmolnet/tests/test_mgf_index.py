@@ -0,0 +1,32 @@
+"""Method to test looking up spectra in an mgf file with an MgfIndex
+"""
+
+from msmolnet import read_mgf
+from msmolnet.MgfIndex import MgfIndex
+import os
+
+def test_mgf_index(tmp_path):
+    """Tests looking up spectra by scans number and precursor mass range.
+    Throws an assertion error if the wrong spectra are returned
+    """
+    blocks=[]
+    for n in [5,3,8,1,7]:
+        blocks.append(f"BEGIN IONS\nPEPMASS={100+n*10}.5\nSCANS={n}\n{50+n} {n*100}\n{60+n} 20\nEND IONS\n")
+    blocks.append("BEGIN IONS\nTITLE=no scans or precursor\n55 10\nEND IONS\n")
+    file_path=tmp_path/"test.mgf"
+    file_path.write_text("\n".join(blocks))
+
+    index=MgfIndex(file_path)
+    assert len(index)==6, "Incorrect number of spectra indexed"
+    assert os.path.exists(index.index_path()), "Index file not saved"
+
+    spectrum=index.get('8')
+    expected=[S for S in read_mgf.read_mgf(file_path,cache=False) if S.feature_id=='8'][0]
+    assert spectrum.feature_id=='8' and spectrum.pep_mass==180.5, "Incorrect spectrum"
+    assert spectrum.mz.tolist()==expected.mz.tolist() and spectrum.parameters==expected.parameters, "Spectrum parsed incorrectly"
+    assert index.get('2') is None, "Spectrum found that is not in the file"
+
+    #index is loaded from the saved file
+    index=MgfIndex(file_path)
+    found=index.range(130.5,170.5)
+    assert [S.feature_id for S in found]==['3','5','7'], "Incorrect spectra in precursor range"
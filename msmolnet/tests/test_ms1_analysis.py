@@ -0,0 +1,101 @@
+"""Method to test the MS1 peak area t-tests
+"""
+
+from msmolnet import ms1_analysis
+from msmolnet import Spectrum
+from scipy import stats
+import random
+import csv
+
+def write_tables(tmp_path,rng,n_features,n_samples):
+    """Write a peak area csv file with other columns between the areas, and a groups csv file of two groups
+    """
+    samples=[f"S{k:03d}" for k in range(n_samples)]
+    groups=[('control' if k%2==0 else 'treated') for k in range(n_samples)]
+    with open(tmp_path/"groups.csv",'w',newline='') as file:
+        writer=csv.writer(file)
+        writer.writerow(['sample','group'])
+        writer.writerows(zip(samples,groups))
+
+    header=['row ID','row m/z']+[name for sample in samples for name in (f"{sample}.mzML Peak area",f"{sample}.mzML Peak height")]
+    with open(tmp_path/"areas.csv",'w',newline='') as file:
+        writer=csv.writer(file)
+        writer.writerow(header)
+        for feature in range(n_features):
+            shift=rng.choice([0,0,50])
+            areas=[rng.gauss(100+(shift if group=='treated' else 0),10) for group in groups]
+            writer.writerow([str(feature+1),str(rng.uniform(100,500))]+[value for area in areas for value in (area,area/2)])
+
+def expected_tests(tmp_path):
+    """t-test of each row from scoring it on its own
+    """
+    groups=ms1_analysis.sample_groups(tmp_path/"groups.csv")
+    expected={}
+    with open(tmp_path/"areas.csv") as file:
+        for row in csv.DictReader(file):
+            areas=[[float(row[f"{sample}.mzML Peak area"]) for sample in groups[group]] for group in ('control','treated')]
+            expected[row['row ID']]=stats.ttest_ind(*areas)
+    return expected
+
+def test_samples_ttest(tmp_path):
+    """Tests that the t-test results added to each spectrum are the same as testing each feature on its own.
+    Throws an assertion error if the results are different
+    """
+    rng=random.Random(24)
+    write_tables(tmp_path,rng,200,12)
+
+    spectra_list=[]
+    for feature in rng.sample(range(1,251),150):
+        spectrum=Spectrum.Spectrum()
+        spectrum.parameters={'SCANS':str(feature)}
+        spectrum.set_id()
+        spectra_list.append(spectrum)
+    order=list(spectra_list)
+
+    ms1_analysis.samples_ttest(tmp_path/"areas.csv",tmp_path/"groups.csv",spectra_list)
+    assert spectra_list==order, "Spectra reordered"
+
+    expected=expected_tests(tmp_path)
+    n_significant=0
+    for spectrum in spectra_list:
+        if spectrum.feature_id not in expected:
+            assert 'p_value' not in spectrum.parameters, "Results added to a spectrum without MS1 data"
+            continue
+        statistic,p_value=expected[spectrum.feature_id]
+        assert abs(spectrum.parameters['tstatistic']-statistic)<1e-9 and abs(spectrum.parameters['p_value']-p_value)<1e-12, "Incorrect t-test"
+        if p_value<=0.05:
+            n_significant+=1
+            assert spectrum.parameters['greater_group']==('control' if statistic>0 else 'treated'), "Incorrect group"
+        else:
+            assert spectrum.parameters['greater_group']=="No significance", "Incorrect significance"
+    assert n_significant>0, "No significant features to compare"
+
+def test_samples_ttest_blocks(tmp_path):
+    """Tests that reading and testing the peak area table in blocks gives the same results as one block, and that the
+    results file has a row for each feature.
+    Throws an assertion error if the results are different
+    """
+    rng=random.Random(25)
+    write_tables(tmp_path,rng,120,9)
+    #blank lines are skipped
+    with open(tmp_path/"areas.csv",'a') as file:
+        file.write("\n\n")
+
+    def results(**options):
+        spectra_list=[]
+        for feature in range(1,121):
+            spectrum=Spectrum.Spectrum()
+            spectrum.parameters={'SCANS':str(feature)}
+            spectrum.set_id()
+            spectra_list.append(spectrum)
+        ms1_analysis.samples_ttest(tmp_path/"areas.csv",tmp_path/"groups.csv",spectra_list,**options)
+        return [dict(spectrum.parameters) for spectrum in spectra_list]
+
+    expected=results()
+    assert results(block_size=7,results_file=tmp_path/"results.csv")==expected, "Incorrect results in blocks"
+
+    with open(tmp_path/"results.csv",newline='') as file:
+        rows=list(csv.DictReader(file))
+    assert [row['ID'] for row in rows]==[parameters['SCANS'] for parameters in expected], "Incorrect results file rows"
+    assert all(float(row['p_value'])==parameters['p_value'] and row['greater_group']==parameters['greater_group']
+        for row,parameters in zip(rows,expected)), "Incorrect results file"
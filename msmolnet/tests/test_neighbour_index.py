@@ -0,0 +1,84 @@
+"""Method to test finding candidate neighbours with the approximate nearest neighbour index
+"""
+
+from msmolnet.NeighbourIndex import NeighbourIndex
+from msmolnet import similarity
+from msmolnet import Spectrum
+import random
+import numpy
+
+def spectrum_families(n_families,size):
+    """List of spectra made of families of noisy copies of random template spectra
+    """
+    spectra_list=[]
+    for family in range(n_families):
+        template=[(mass/2,random.uniform(1,100)) for mass in random.sample(range(100,800),20)]
+        pep_mass=random.uniform(200,400)
+        for k in range(size):
+            spectrum=Spectrum.Spectrum()
+            for mass,intensity in template:
+                if random.random()<0.8:
+                    spectrum.add_peak(mass+random.uniform(-0.05,0.05),intensity*random.uniform(0.5,1.5))
+            for mass in random.sample(range(100,800),5):
+                spectrum.add_peak(mass/2,random.uniform(1,30))
+            spectrum.pep_mass=pep_mass+random.uniform(0,15)
+            spectrum.parameters={'SCANS':str(len(spectra_list))}
+            spectrum.set_id()
+            spectrum.euclidean_scale()
+            spectra_list.append(spectrum)
+    return spectra_list
+
+def test_neighbour_index():
+    """Tests that scoring only the candidate pairs finds most of the best neighbours with fewer pairs, and gives the same
+    scores as scoring every pair.
+    Throws an assertion error if the candidates are not correct
+    """
+    random.seed(8)
+    spectra_list=spectrum_families(40,8)
+    index=NeighbourIndex(spectra_list,0.3,20.0)
+
+    first,second=index.candidate_pairs(5)
+    assert (first<second).all(), "Pairs not ordered"
+    window_pairs=sum(len(block) for block,_ in similarity.candidate_pairs(spectra_list,20.0))
+    assert 0<len(first)<window_pairs, "Candidate pairs not reduced"
+
+    neighbours=index.neighbours(5)
+    assert len(neighbours)==len(spectra_list) and sum(len(n) for n in neighbours)==2*len(first), "Incorrect neighbours"
+
+    exact=similarity.compare_all(spectra_list,precursor_tolerance=20.0)
+    approximate=similarity.compare_all(spectra_list,precursor_tolerance=20.0,pairs=(first,second))
+    for S1 in approximate:
+        for S2,match in approximate[S1].items():
+            assert exact[S1][S2]==match, "Incorrect score"
+
+    report=index.recall_report(5,sample_size=200,cosine_threshold=0.5,peak_threshold=3)
+    assert report['exact_pairs']>0 and report['recall']>=0.8, "Too few neighbours found"
+    assert report['candidate_pairs']<report['window_pairs'], "Candidate pairs not reduced"
+
+def test_neighbour_index_prefilter():
+    """Tests that scoring the candidate pairs with a prefilter only scores the candidates that prefilter_pairs also keeps.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(9)
+    spectra_list=spectrum_families(30,6)
+    first,second=NeighbourIndex(spectra_list,0.3,20.0).candidate_pairs(5)
+
+    prefiltered={pair for block in similarity.prefilter_pairs(spectra_list,0.3,20.0,0.4) for pair in zip(*block)}
+    keep=numpy.array([pair in prefiltered for pair in zip(first.tolist(),second.tolist())])
+    assert 0<keep.sum()<len(first), "No candidates removed by prefilter"
+
+    expected=similarity.compare_all(spectra_list,precursor_tolerance=20.0,pairs=(first[keep],second[keep]))
+    matches=similarity.compare_all(spectra_list,precursor_tolerance=20.0,pairs=(first,second),prefilter=0.4)
+    assert matches==expected, "Incorrect matches"
+
+def test_neighbour_index_blocks(monkeypatch):
+    """Tests that hashing the spectra a block at a time gives the same bucket codes as hashing them all at once.
+    Throws an assertion error if the codes are different
+    """
+    random.seed(10)
+    spectra_list=spectrum_families(20,5)
+    expected=NeighbourIndex(spectra_list,0.3,20.0).codes
+    assert expected.shape==(len(spectra_list),32), "Incorrect number of codes"
+
+    monkeypatch.setattr(similarity,'ROWS_PER_BLOCK',7)
+    assert (NeighbourIndex(spectra_list,0.3,20.0).codes==expected).all(), "Incorrect codes in blocks"
@@ -0,0 +1,60 @@
+"""Method to test reading spectra from an mgf file
+"""
+
+from msmolnet import read_mgf
+
+MGF="""BEGIN IONS
+PEPMASS=250.1
+SCANS=1
+50.7 234
+54.6 585
+60.7 773
+END IONS
+
+BEGIN IONS
+PEPMASS=300.2
+SCANS=2
+TITLE=a=b
+65.6 387
+87.7 546
+END IONS
+"""
+
+def test_read_mgf(tmp_path):
+    """Tests that the streaming and list readers give the same spectra.
+    Throws an assertion error if the parsing is not correct
+    """
+    file_path=tmp_path/"test.mgf"
+    file_path.write_text(MGF)
+
+    streamed=read_mgf.iter_mgf(file_path)
+    first=next(streamed)
+    assert first.feature_id=='1' and first.pep_mass==250.1, "Incorrect first spectrum"
+    assert [p.mass for p in first.peaks]==[50.7,54.6,60.7], "Incorrect peaks"
+
+    spectra=read_mgf.read_mgf(file_path)
+    assert [s.feature_id for s in spectra]==['1','2'], "Incorrect spectra"
+    assert spectra[1].parameters['TITLE']=='a=b', "Incorrect parameter value"
+    assert hasattr(spectra[1].peaks[0],'scaled_intensity'), "Peaks were not scaled"
+
+def test_read_mgf_parallel(tmp_path):
+    """Tests that parsing an mgf file in parallel byte ranges gives the same spectra as the serial reader.
+    Throws an assertion error if the spectra are different
+    """
+    blocks=[]
+    for n in range(40):
+        peaks="\r\n".join(f"{50+n+k*1.5} {100*k+n}" for k in range(n%7))
+        blocks.append(f"BEGIN IONS\r\nPEPMASS={200+n*0.5}\r\nSCANS={n}\r\n{peaks}\r\nEND IONS\r\n")
+    file_path=tmp_path/"test.mgf"
+    file_path.write_bytes(("COMMENT before first spectrum\r\n"+"\r\n".join(blocks)).encode())
+
+    serial=read_mgf.read_mgf(file_path,cache=False)
+    parallel=read_mgf.read_mgf_parallel(file_path,workers=2,chunks=7)
+
+    assert len(read_mgf.spectrum_ranges(file_path,7))==7, "File not split into ranges"
+    assert len(parallel)==len(serial)==40, "Incorrect number of spectra"
+    for S1,S2 in zip(serial,parallel):
+        assert S1.feature_id==S2.feature_id and S1.parameters==S2.parameters, "Incorrect metadata"
+        assert S1.pep_mass==S2.pep_mass, "Incorrect precursor mass"
+        assert S1.mz.tolist()==S2.mz.tolist(), "Incorrect peaks"
+        assert S1.scaled_intensity.tolist()==S2.scaled_intensity.tolist(), "Incorrect scaled intensities"
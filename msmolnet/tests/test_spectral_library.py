@@ -0,0 +1,161 @@
+"""Method to test searching a spectral library saved next to its mgf file
+"""
+
+from msmolnet.SpectralLibrary import SpectralLibrary
+from msmolnet.ShardedLibrary import ShardedLibrary
+from msmolnet import similarity
+from msmolnet import read_mgf
+from msmolnet import Spectrum
+import numpy as np
+import random
+import os
+
+def write_library(file_path,n):
+    """Write an mgf file of random library spectra, many with close precursor masses
+    """
+    blocks=[]
+    for k in range(n):
+        peaks="\n".join(f"{mass/2} {random.uniform(1,100)}" for mass in sorted(random.sample(range(100,300),random.randint(3,15))))
+        blocks.append(f"BEGIN IONS\nPEPMASS={random.choice([200,201,230])+random.uniform(0,1):.4f}\nSCANS=L{k}\nNAME=lib{k}\n{peaks}\nEND IONS\n")
+    file_path.write_text("\n".join(blocks))
+
+def reference_match(spectrum,library,precursor_tol,cosine,n_peaks):
+    """Best match from scoring every library spectrum
+    """
+    matches=[]
+    for lib in library:
+        score,peaks=similarity.cosine_score_max(spectrum,lib,modified=False,precursor_tolerance=precursor_tol)
+        if score>=cosine and peaks>=n_peaks:
+            matches.append((score,lib.pep_mass,lib.parameters))
+    matches.sort(key=lambda match: (-match[0],match[1]))
+    return matches[0][2] if matches else None
+
+def test_spectral_library(tmp_path):
+    """Tests that library matching finds the same best match as scoring every library spectrum, and that the library is
+    saved and memory mapped, but not loaded without the cache.
+    Throws an assertion error if a match is different
+    """
+    random.seed(12)
+    library_path=tmp_path/"library.mgf"
+    write_library(library_path,150)
+    spectra_path=tmp_path/"spectra.mgf"
+    write_library(spectra_path,60)
+
+    library=SpectralLibrary(library_path)
+    assert os.path.isdir(library.library_path()), "Library not saved"
+    assert isinstance(SpectralLibrary(library_path).bin_spectra,np.memmap), "Library not memory mapped"
+    assert not isinstance(SpectralLibrary(library_path,save=False,load=False).bin_spectra,np.memmap), "Saved library loaded"
+    assert len(library)==150 and (np.diff(library.pep_mass)>=0).all(), "Library not sorted"
+    lo,hi=library.range(200,201)
+    assert hi-lo>4, "Not enough spectra in the precursor range"
+
+    spectra_list=read_mgf.read_mgf(spectra_path)
+    similarity.library_match(spectra_list,library_path,precursor_tol=1.0,cosine=0.3,n_peaks=2)
+    reference=read_mgf.read_mgf(library_path)
+    found=0
+    for spectrum in spectra_list:
+        expected=reference_match(spectrum,reference,1.0,0.3,2)
+        assert getattr(spectrum,'library_parameters',None)==expected, "Incorrect library match"
+        found+=expected is not None
+    assert found>0, "No library matches to compare"
+
+def test_library_search(tmp_path):
+    """Tests that searching the library with a pool of processes gives the same top matches as one process, best first.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(13)
+    library_path=tmp_path/"library.mgf"
+    write_library(library_path,150)
+    spectra_path=tmp_path/"spectra.mgf"
+    write_library(spectra_path,250)
+    spectra_list=read_mgf.read_mgf(spectra_path)
+
+    expected=similarity.library_search(spectra_list,library_path,cosine=0.2,n_peaks=2,top_k=3)
+    assert any(len(hits)>1 for hits in expected), "No spectra with more than one match"
+    assert all(len(hits)<=3 for hits in expected), "Too many matches"
+    assert all(hits[k]['cosine']>=hits[k+1]['cosine'] for hits in expected for k in range(len(hits)-1)), "Matches not sorted"
+    assert similarity.library_search(spectra_list,library_path,cosine=0.2,n_peaks=2,top_k=3,workers=2)==expected, "Incorrect parallel matches"
+
+    similarity.library_match(spectra_list,library_path,cosine=0.2,n_peaks=2,top_k=3)
+    for spectrum,hits in zip(spectra_list,expected):
+        if hits:
+            assert spectrum.library_parameters==hits[0]['parameters'] and spectrum.library_hits==hits, "Incorrect library hits"
+
+def test_library_search_workers_no_cache(tmp_path,monkeypatch):
+    """Tests that a pool of processes searching a library without the cache gives the same matches as one process, with
+    the library parsed once by the parent process and nothing saved next to the mgf file.
+    Throws an assertion error if the matches are different or a process parses the library
+    """
+    random.seed(14)
+    library_path=tmp_path/"library.mgf"
+    write_library(library_path,150)
+    spectra_path=tmp_path/"spectra.mgf"
+    write_library(spectra_path,250)
+    spectra_list=read_mgf.read_mgf(spectra_path,cache=False)
+    expected=similarity.library_search(spectra_list,library_path,cosine=0.2,n_peaks=2,top_k=3,cache=False)
+    assert any(expected), "No matches to compare"
+
+    parent=os.getpid()
+    parse=read_mgf.read_mgf
+    def parse_in_parent(*args,**kwargs):
+        assert os.getpid()==parent, "Library parsed in a pool process"
+        return parse(*args,**kwargs)
+    monkeypatch.setattr(read_mgf,'read_mgf',parse_in_parent)
+
+    for cache in [False,True]:
+        found=similarity.library_search(spectra_list,library_path,cosine=0.2,n_peaks=2,top_k=3,workers=2,cache=cache)
+        assert found==expected, "Incorrect parallel matches"
+        assert os.path.isdir(f"{library_path}.msmolnet-library")==cache, "Incorrect library saved"
+
+def test_analog_search(tmp_path):
+    """Tests that analog search finds the same best match as scoring every library spectrum with modified cosine, for
+    spectra made by shifting the precursor mass and some fragments of library spectra.
+    Throws an assertion error if a match is different
+    """
+    random.seed(14)
+    library_path=tmp_path/"library.mgf"
+    write_library(library_path,200)
+    library=read_mgf.read_mgf(library_path)
+
+    spectra_list=[]
+    for lib in random.sample(library,30):
+        shift=random.choice([14.0157,15.9949,-2.0157,42.0106,120.3])
+        spectrum=Spectrum.Spectrum()
+        for mass,intensity in zip(lib.mz.tolist(),lib.intensity.tolist()):
+            spectrum.add_peak(mass+shift if random.random()<0.5 else mass,intensity*random.uniform(0.8,1.2))
+        spectrum.pep_mass=lib.pep_mass+shift
+        spectrum.parameters={'SCANS':lib.feature_id}
+        spectrum.set_id()
+        spectrum.euclidean_scale()
+        spectra_list.append(spectrum)
+
+    hits=similarity.library_search(spectra_list,library_path,cosine=0.5,n_peaks=3,analog=True)
+    assert similarity.library_search(spectra_list,library_path,cosine=0.5,n_peaks=3)!=hits, "Analogs found without analog search"
+    for spectrum,spectrum_hits in zip(spectra_list,hits):
+        scores=[similarity.cosine_score_max(spectrum,lib,modified=True,precursor_tolerance=1000) for lib in library]
+        best=max(score for score,peaks in scores if peaks>=3)
+        assert spectrum_hits[0]['cosine']==best, "Incorrect analog match"
+        assert spectrum_hits[0]['parameters']['SCANS']==spectrum.feature_id, "Library spectrum not found"
+
+def test_sharded_library(tmp_path):
+    """Tests that searching a library split into shards gives the same top matches as the whole library, with no more
+    than max_open shards memory mapped at once.
+    Throws an assertion error if the matches are different
+    """
+    random.seed(15)
+    library_path=tmp_path/"library.mgf"
+    write_library(library_path,150)
+    spectra_path=tmp_path/"spectra.mgf"
+    write_library(spectra_path,100)
+    spectra_list=read_mgf.read_mgf(spectra_path)
+
+    library=ShardedLibrary(library_path,shard_size=20,max_open=2)
+    assert len(library)==150 and len(library.sizes)==8, "Incorrect shards"
+    assert (library.pepmass_lo[1:]>=library.pepmass_hi[:-1]).all(), "Shards not sorted by precursor mass"
+    assert len(library.libraries(200.5,230.5))>2, "Too few shards in the precursor range"
+    assert len(library._open)<=2, "Too many shards open"
+
+    expected=similarity.library_search(spectra_list,library_path,cosine=0.2,n_peaks=2,top_k=3)
+    assert any(expected), "No library matches to compare"
+    assert similarity.library_search(spectra_list,library_path,cosine=0.2,n_peaks=2,top_k=3,shard_size=20)==expected, "Incorrect sharded matches"
+    assert similarity.library_search(spectra_list,library_path,cosine=0.2,n_peaks=2,top_k=3,shard_size=20,workers=2)==expected, "Incorrect parallel sharded matches"
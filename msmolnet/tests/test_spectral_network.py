@@ -0,0 +1,62 @@
+"""Method to test filtering a molecular network held as arrays
+"""
+
+from msmolnet import network
+from msmolnet.SpectralNetwork import SpectralNetwork
+from msmolnet.EdgeTable import EdgeTable
+from msmolnet import Spectrum
+import networkx as nx
+import random
+
+def random_network(rng,n):
+    """Make a list of spectra and a dictionary of random matches between them, with different cosine scores
+    """
+    spectra_list=[]
+    for k in range(n):
+        spectrum=Spectrum.Spectrum()
+        spectrum.pep_mass=100.0+k
+        spectrum.parameters={'SCANS':str(k)}
+        spectrum.set_id()
+        spectra_list.append(spectrum)
+
+    density=rng.uniform(0.02,0.3)
+    matches={}
+    for one in range(n):
+        for two in range(one+1,n):
+            if rng.random()<density:
+                match={'cosine':rng.random(),'peaks':rng.randint(1,10)}
+                matches.setdefault(spectra_list[one],{})[spectra_list[two]]=match
+                matches.setdefault(spectra_list[two],{})[spectra_list[one]]=dict(match)
+    return spectra_list,matches
+
+def edge_set(graph):
+    return set(map(frozenset,graph.edges()))
+
+def test_spectral_network():
+    """Tests that filtering the array network removes the same edges as filtering the networkx graph, and that the
+    result doesn't depend on the order of the spectra.
+    Throws an assertion error if the filtered networks are different
+    """
+    rng=random.Random(22)
+    for trial in range(30):
+        n=rng.randint(5,80)
+        spectra_list,matches=random_network(rng,n)
+        n_neighbours=rng.randint(1,6)
+        family_size=rng.randint(1,15)
+
+        molecular_network=SpectralNetwork(spectra_list,matches)
+        n_families,labels=molecular_network.families()
+        assert n_families==nx.number_connected_components(network.make_network(spectra_list,matches)), "Incorrect families"
+
+        neighbours=molecular_network.filter_neighbors(n_neighbours)
+        expected=network.filter_neighbors(network.make_network(spectra_list,matches),n_neighbours)
+        assert edge_set(neighbours.to_networkx())==edge_set(expected), "Incorrect neighbour filtering"
+
+        filtered=neighbours.filter_family(family_size)
+        expected=network.filter_family(expected,family_size)
+        assert edge_set(filtered.to_networkx())==edge_set(expected), "Incorrect family filtering"
+        assert all(len(family)<=family_size for family in nx.connected_components(expected)), "Family too large"
+
+        shuffled=rng.sample(spectra_list,n)
+        reordered=SpectralNetwork(shuffled,EdgeTable.from_dict(shuffled,matches)).filter_neighbors(n_neighbours).filter_family(family_size)
+        assert edge_set(reordered.to_networkx())==edge_set(expected), "Filtering depends on the order of the spectra"
@@ -0,0 +1,24 @@
+"""Method to test the peak arrays held by a Spectrum
+"""
+
+from msmolnet import Spectrum
+import numpy as np
+
+def test_spectrum_arrays():
+    """Tests that peaks are kept as arrays sorted by mass, with a matching list of Peak objects.
+    Throws an assertion error if the peaks are not stored correctly
+    """
+    spectrum=Spectrum.Spectrum()
+    spectrum.add_peak(60.7,773)
+    spectrum.add_peak(50.7,234)
+    spectrum.add_peak(54.6,585)
+    spectrum.euclidean_scale()
+
+    assert spectrum.mz.tolist()==[50.7,54.6,60.7], "Peaks not sorted by mass"
+    assert spectrum.intensity.tolist()==[234,585,773], "Intensities not sorted with masses"
+    assert np.isclose(np.sum(spectrum.scaled_intensity**2),1), "Incorrect normalisation"
+
+    peak=spectrum.peaks[2]
+    assert peak.mass==60.7 and peak.intensity==773, "Incorrect peak"
+    assert peak.scaled_intensity==spectrum.scaled_intensity[2], "Incorrect peak scaled intensity"
+    assert not hasattr(spectrum,'__dict__'), "Spectrum should not have a __dict__"
@@ -0,0 +1,76 @@
+"""Method to test writing a molecular network one node and edge at a time
+"""
+
+from msmolnet import network
+from msmolnet import write_network
+from msmolnet.SpectralNetwork import SpectralNetwork
+from msmolnet import Spectrum
+import networkx as nx
+import random
+import json
+import gzip
+import csv
+
+def make_network(rng,n):
+    """Make a SpectralNetwork of spectra with metadata and library matches, and random edges
+    """
+    spectra_list=[]
+    for k in range(n):
+        spectrum=Spectrum.Spectrum()
+        spectrum.pep_mass=100.0+k
+        spectrum.parameters={'SCANS':str(k),'PEPMASS':str(100.0+k),'NAME':f'feature <{k}> & "more"'}
+        spectrum.set_id()
+        if rng.random()<0.3:
+            spectrum.library_parameters={'NAME':f'lib{k}'}
+            spectrum.library_hits=[{'cosine':0.9,'peaks':5,'parameters':spectrum.library_parameters},
+                {'cosine':rng.random(),'peaks':rng.randint(1,9),'parameters':{'NAME':f'other{k}'}}]
+        spectra_list.append(spectrum)
+
+    matches={}
+    for one in range(n):
+        for two in range(one+1,n):
+            if rng.random()<0.1:
+                match={'cosine':rng.random(),'peaks':rng.randint(1,10)}
+                matches.setdefault(spectra_list[one],{})[spectra_list[two]]=match
+                matches.setdefault(spectra_list[two],{})[spectra_list[one]]=dict(match)
+    return SpectralNetwork(spectra_list,matches)
+
+def edge_data(graph):
+    """Attributes of each edge, without the direction the edge was written in
+    """
+    return {frozenset(edge[:2]):{key:value for key,value in edge[2].items() if key not in ('source','target')}
+        for edge in graph.edges(data=True)}
+
+def test_write_network(tmp_path):
+    """Tests that the GraphML, Cytoscape JSON and CSV files have the same nodes, edges and attributes as the networkx graph
+    of the network, with and without gzip.
+    Throws an assertion error if the files are different
+    """
+    molecular_network=make_network(random.Random(23),60)
+    graph=molecular_network.to_networkx()
+    network.write_graphml(graph,tmp_path/"expected.graphml")
+    expected=nx.read_graphml(tmp_path/"expected.graphml")
+    assert expected.number_of_edges()>0, "No edges to compare"
+
+    for file_name in ("network.graphml","network.graphml.gz"):
+        write_network.write_graphml(tmp_path/file_name,molecular_network)
+        written=nx.read_graphml(tmp_path/file_name)
+        assert dict(written.nodes(data=True))==dict(expected.nodes(data=True)), "Incorrect GraphML nodes"
+        assert edge_data(written)==edge_data(expected), "Incorrect GraphML edges"
+
+    write_network.write_cytoscape(tmp_path/"network.json.gz",molecular_network)
+    with gzip.open(tmp_path/"network.json.gz",'rt') as file:
+        written=nx.cytoscape_graph(json.load(file))
+    reference=nx.cytoscape_graph(nx.cytoscape_data(nx.relabel_nodes(graph,str)))
+    assert dict(written.nodes(data=True))==dict(reference.nodes(data=True)), "Incorrect Cytoscape nodes"
+    assert edge_data(written)==edge_data(reference), "Incorrect Cytoscape edges"
+
+    write_network.write_tables(tmp_path/"nodes.csv",tmp_path/"edges.csv.gz",molecular_network)
+    with open(tmp_path/"nodes.csv",newline='') as file:
+        nodes={row['id']:row for row in csv.DictReader(file)}
+    assert nodes.keys()==expected.nodes.keys(), "Incorrect node table"
+    assert all(nodes[node]['NAME']==data['NAME'] for node,data in expected.nodes(data=True)), "Incorrect node attributes"
+    with gzip.open(tmp_path/"edges.csv.gz",'rt',newline='') as file:
+        edges={frozenset((row['source'],row['target'])):{'cosine':float(row['cosine']),'peaks':int(row['peaks'])}
+            for row in csv.DictReader(file)}
+    assert edges==edge_data(expected), "Incorrect edge table"
@@ -32,6 +32,14 @@ def convert_scores(scores):
     
     return matches
 
+def match_spectra(matches,spectra_list):
+    """Takes a dictionary of matches from convert_scores, keyed by scans numbers, and the converted MSMolNet spectra, and
+    returns the same matches keyed by the Spectrum objects with those feature IDs, for use with SpectralNetwork
+    Returns: dict
+    """
+    spectra={S.feature_id:S for S in spectra_list}
+    return {spectra[one]:{spectra[two]:match for two,match in partners.items()} for one,partners in matches.items()}
+
 
 def convert_spectrum(matchms_spectrum):
     """Converts a matchms Spectrum object into a MSMolNet Spectrum object
@@ -42,8 +50,7 @@ def convert_spectrum(matchms_spectrum):
     intensities=peaks.intensities
     spectrum=Spectrum()
 
-    for i in range(len(mz)):
-        spectrum.add_peak(mz[i],intensities[i])
+    spectrum.set_peaks(mz,intensities)
 
     spectrum.parameters=matchms_spectrum.metadata
 
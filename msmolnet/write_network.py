@@ -0,0 +1,130 @@
+"""Methods to write a molecular network to a file as it is read from the edge table, without making a graph object
+"""
+
+import csv
+import gzip
+import json
+import numpy
+from msmolnet.network import node_attributes
+
+#number of edges taken from the edge table at a time
+EDGES_PER_CHUNK=100000
+
+#GraphML types of the attribute values, as networkx writes them
+GRAPHML_TYPES={bool:'boolean',int:'long',float:'double',str:'string'}
+
+#characters replaced in XML text, and also in attribute values
+XML_TEXT=str.maketrans({'&':'&amp;','<':'&lt;','>':'&gt;'})
+XML_ATTRIBUTE=str.maketrans({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;','\n':'&#10;','\r':'&#13;','\t':'&#9;'})
+
+def write_graphml(file_path,molecular_network):
+    """Takes a file name and a SpectralNetwork and writes the network to a GraphML file, one node or edge at a time.
+    The nodes are the spectra with their metadata (see network.node_attributes), and the edges have the cosine score
+    and number of matching peaks. Attributes with values of different types are written as strings.
+    The file is compressed with gzip if the file name ends with '.gz'"""
+    node_types=_attribute_types(molecular_network)
+    node_keys={name:f"d{k}" for k,name in enumerate(node_types)}
+    edge_keys={'cosine':f"d{len(node_keys)}",'peaks':f"d{len(node_keys)+1}"}
+
+    with _open_output(file_path) as file:
+        file.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        file.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+        for name,key in node_keys.items():
+            file.write(f'<key id="{key}" for="node" attr.name={_quote(name)} attr.type="{node_types[name]}"/>\n')
+        file.write(f'<key id="{edge_keys["cosine"]}" for="edge" attr.name="cosine" attr.type="double"/>\n')
+        file.write(f'<key id="{edge_keys["peaks"]}" for="edge" attr.name="peaks" attr.type="long"/>\n')
+        file.write('<graph edgedefault="undirected">\n')
+
+        for N in molecular_network.spectra_list:
+            file.write(f'<node id={_quote(str(N))}>\n')
+            for name,value in node_attributes(N).items():
+                file.write(f'  <data key="{node_keys[name]}">{str(value).translate(XML_TEXT)}</data>\n')
+            file.write('</node>\n')
+
+        cosine_key,peaks_key=edge_keys['cosine'],edge_keys['peaks']
+        for sources,targets,cosines,peak_counts in _edge_chunks(molecular_network,_quote):
+            file.write(''.join(f'<edge source={source} target={target}>\n  <data key="{cosine_key}">{cosine!r}</data>\n'
+                f'  <data key="{peaks_key}">{peaks}</data>\n</edge>\n'
+                for source,target,cosine,peaks in zip(sources,targets,cosines,peak_counts)))
+
+        file.write('</graph></graphml>\n')
+
+def write_cytoscape(file_path,molecular_network):
+    """Takes a file name and a SpectralNetwork and writes the network to a Cytoscape JSON file, one node or edge at a time,
+    in the layout of networkx.cytoscape_data so it can be read with networkx.cytoscape_graph as well as by Cytoscape.
+    The file is compressed with gzip if the file name ends with '.gz'"""
+    with _open_output(file_path) as file:
+        file.write('{"data": {}, "directed": false, "multigraph": false, "elements": {"nodes": [')
+        separator='\n'
+        for N in molecular_network.spectra_list:
+            node_id=str(N)
+            data=node_attributes(N)
+            data.update({'id':node_id,'value':node_id,'name':node_id})
+            file.write(separator+json.dumps({'data':data},default=str))
+            separator=',\n'
+
+        file.write('\n], "edges": [')
+        separator='\n'
+        for sources,targets,cosines,peak_counts in _edge_chunks(molecular_network,json.dumps):
+            file.write(separator+',\n'.join(f'{{"data": {{"source": {source}, "target": {target}, "cosine": {cosine!r}, '
+                f'"peaks": {peaks}}}}}' for source,target,cosine,peaks in zip(sources,targets,cosines,peak_counts)))
+            separator=',\n'
+        file.write('\n]}}\n')
+
+def write_tables(node_path,edge_path,molecular_network):
+    """Takes file names for the node and edge tables and a SpectralNetwork and writes the network as two CSV files:
+    one row for each spectrum with its id and metadata, and one row for each edge with the ids of its spectra, the cosine
+    score and the number of matching peaks.
+    Each file is compressed with gzip if its name ends with '.gz'"""
+    columns=['id']+[name for name in _attribute_types(molecular_network) if name!='id']
+    with _open_output(node_path) as file:
+        writer=csv.DictWriter(file,fieldnames=columns)
+        writer.writeheader()
+        for N in molecular_network.spectra_list:
+            row=node_attributes(N)
+            row['id']=str(N)
+            writer.writerow(row)
+
+    with _open_output(edge_path) as file:
+        writer=csv.writer(file)
+        writer.writerow(['source','target','cosine','peaks'])
+        for sources,targets,cosines,peak_counts in _edge_chunks(molecular_network,str):
+            writer.writerows(zip(sources,targets,map(repr,cosines),peak_counts))
+
+def _attribute_types(molecular_network):
+    """Returns a dictionary of the name of each node attribute and its GraphML type, in the order they are first found
+    """
+    types={}
+    for N in molecular_network.spectra_list:
+        for name,value in node_attributes(N).items():
+            value_type=GRAPHML_TYPES.get(type(value),'string')
+            if types.setdefault(name,value_type)!=value_type:
+                types[name]='string'
+    return types
+
+def _edge_chunks(molecular_network,format_id):
+    """Yields the edges a chunk of the edge table at a time, as lists of source ids, target ids, cosine scores and numbers
+    of peaks. The ids are the spectra as strings, passed through format_id"""
+    spectra_list=molecular_network.spectra_list
+    edges=molecular_network.table.edges
+    for start in range(0,len(edges),EDGES_PER_CHUNK):
+        chunk=edges[start:start+EDGES_PER_CHUNK]
+        #format the id of each spectrum in the chunk once
+        positions,inverse=numpy.unique(numpy.concatenate((chunk['i'],chunk['j'])),return_inverse=True)
+        ids=[format_id(str(spectra_list[k])) for k in positions.tolist()]
+        ends=[ids[k] for k in inverse.tolist()]
+        yield ends[:len(chunk)],ends[len(chunk):],chunk['cosine'].tolist(),chunk['peaks'].tolist()
+
+def _quote(text):
+    """Returns text as a quoted XML attribute value
+    """
+    return '"'+text.translate(XML_ATTRIBUTE)+'"'
+
+def _open_output(file_path):
+    """Open a file for writing text, with gzip compression if the file name ends with '.gz'
+    """
+    if str(file_path).endswith('.gz'):
+        return gzip.open(file_path,'wt',encoding='utf-8',newline='')
+    return open(file_path,'w',encoding='utf-8',newline='')
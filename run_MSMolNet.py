@@ -16,8 +16,8 @@ positional arguments:
 optional arguments:
   -h, --help            show this help message and exit
   -o OUTPUT, --output OUTPUT
-                        Output GraphML file path and name, excluding
-                        '.graphml' (default: output)
+                        Output file path and name, excluding the extension
+                        (default: output)
   -p PEAKS, --peaks PEAKS
                         Minimum number of peaks required to match a spectrum
                         (default: 6)
@@ -36,9 +36,18 @@ optional arguments:
   -ft FRAGMENT_TOLERANCE, --fragment-tolerance FRAGMENT_TOLERANCE
                         Fragment tolerance when comparing two fragment peaks
                         (default: 0.3)
+  --prefilter PREFILTER
+                        Only calculate exact scores for pairs of spectra with
+                        a binned approximate cosine of at least this value;
+                        with --approximate, only for the candidate neighbours
+                        that also pass it (default: None)
+  --approximate         Only calculate exact scores for the candidate neighbours
+                        of each spectrum from an approximate nearest neighbour
+                        index, instead of every pair (default: False)
   -n N_NEIGHBOURS, --n-neighbours N_NEIGHBOURS
                         Maximum number of neighbours a spectrum can have in
-                        the network (default: 10)
+                        the network; an edge is kept if it is among the best
+                        of both spectra (default: 10)
   -f FAMILY_SIZE, --family-size FAMILY_SIZE
                         Maximum molecular family size allowed in the network
                         (default: 100)
@@ -54,17 +63,61 @@ optional arguments:
   -lpt LIB_PRECURSOR_TOLERANCE, --lib-precursor-tolerance LIB_PRECURSOR_TOLERANCE
                         Precursor mass tolerance allowed when matching to
                         library spectra (default: 1.0)
+  --library-top-k LIBRARY_TOP_K
+                        Number of best library matches kept for each
+                        spectrum; matches after the best are added to the
+                        nodes as library_2_..., library_3_... (default: 1)
+  --analog              Search the library for modified analogs with modified
+                        cosine, up to the maximum modification mass away,
+                        instead of matching precursor masses (default: False)
+  --library-shard-size LIBRARY_SHARD_SIZE
+                        Split the library into shards of this many spectra by
+                        precursor mass and only load the shards needed, for
+                        libraries too large for memory (default: None)
   --matchms             use the MatchMS for reading mgf file and calculating
                         similarities (default: False)
+  -j JOBS, --jobs JOBS  Number of processes used to read the mgf file,
+                        calculate similarity scores and search the library
+                        (default: 1)
+  --no-cache            Always parse the mgf files instead of using or writing
+                        the binary spectrum cache next to them (default:
+                        False)
+  --score-cache SCORE_CACHE
+                        SQLite file of saved pair scores; pairs already scored
+                        with the same scoring settings are not scored again,
+                        whatever the score and peaks thresholds (default:
+                        None)
+  --edge-file EDGE_FILE
+                        Write the spectrum matches that pass the score and
+                        peaks thresholds to this binary file as they are
+                        calculated, instead of keeping them in memory
+                        (default: None)
+  --format {graphml,cytoscape,csv}
+                        Output format: GraphML, Cytoscape JSON ('.json'), or
+                        CSV node and edge tables ('_nodes.csv' and
+                        '_edges.csv') (default: graphml)
+  --gzip                Compress the output files with gzip, adding '.gz' to
+                        their names (default: False)
   --ms1 MS1 MS1         Do t-test on MS1 data. Requires a .csv file of peak
                         area in each sample for each spectrum and a .csv file
                         with columns "sample" and "group" (default: None)
+  --ms1-results MS1_RESULTS
+                        Write the t-test result of every MS1 feature to this
+                        .csv file (default: None)
 
 '''
 
 import argparse
 from msmolnet import similarity
 
+def positive_int(value):
+    """argparse type for a whole number of at least 1
+    """
+    number=int(value)
+    if number<1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return number
+
 # #used to measure run time
 # import time
 # start = time.time()
@@ -83,7 +136,7 @@ parser.add_argument(
 parser.add_argument(
     '-o',
     '--output',
-    help='Output GraphML file path and name, excluding \'.graphml\'',
+    help='Output file path and name, excluding the extension',
     default='output'
     )
 
@@ -133,10 +186,22 @@ parser.add_argument(
     default=0.3
 )
 
+parser.add_argument(
+    '--prefilter',
+    help='Only calculate exact scores for pairs of spectra with a binned approximate cosine of at least this value; with --approximate, only for the candidate neighbours that also pass it',
+    type=float
+)
+
+parser.add_argument(
+    '--approximate',
+    help='Only calculate exact scores for the candidate neighbours of each spectrum from an approximate nearest neighbour index, instead of every pair',
+    action='store_true'
+)
+
 parser.add_argument(
     '-n',
     '--n-neighbours',
-    help='Maximum number of neighbours a spectrum can have in the network',
+    help='Maximum number of neighbours a spectrum can have in the network; an edge is kept if it is among the best of both spectra',
     type=int,
     default=10
 )
@@ -181,108 +246,211 @@ parser.add_argument(
 
 
 parser.add_argument(
-    '--matchms',
-    help='use the MatchMS for reading mgf file and calculating similarities',
-    action='store_true'
+    '--library-top-k',
+    help='Number of best library matches kept for each spectrum; matches after the best are added to the nodes as library_2_..., library_3_...',
+    type=int,
+    default=1
 )
 
 parser.add_argument(
-    '--ms1',
-    help='''Do t-test on MS1 data. Requires a .csv file of peak area in each sample for each spectrum 
-    and a .csv file with columns "sample" and "group"''',
-    nargs=2
-    
+    '--analog',
+    help='Search the library for modified analogs with modified cosine, up to the maximum modification mass away, instead of matching precursor masses',
+    action='store_true'
 )
 
+parser.add_argument(
+    '--library-shard-size',
+    help='Split the library into shards of this many spectra by precursor mass and only load the shards needed, for libraries too large for memory',
+    type=int,
+    default=None
+)
 
-args = parser.parse_args()
-print(args)
+parser.add_argument(
+    '--matchms',
+    help='use the MatchMS for reading mgf file and calculating similarities',
+    action='store_true'
+)
 
-if (args.matchms):
-    print('use matchms')
-    import matchms
-    from matchms.importing import load_from_mgf
-    from matchms.filtering import default_filters
-    from matchms.filtering import normalize_intensities
-    from matchms.filtering import add_precursor_mz
-    from matchms import calculate_scores
-    from matchms.similarity import ModifiedCosine
-    from msmolnet.use_matchms import convert_matches as convert
-    
-    input_mgf=f'{args.input}.mgf'
-    print(f"reading file {input_mgf}")
-    file=load_from_mgf(input_mgf)
-    print(file)
+parser.add_argument(
+    '-j',
+    '--jobs',
+    help='Number of processes used to read the mgf file, calculate similarity scores and search the library',
+    type=positive_int,
+    default=1
+)
 
-    print("normalising intensities")
-    
-    # Apply filters to clean and enhance each spectrum
-    spectrums = []
-    for spectrum in file:
-        spectrum = default_filters(spectrum)
-        # Scale peak intensities to maximum of 1
-        spectrum = normalize_intensities(spectrum)
-        print(spectrum.get('precursor_mz'))
-        spectrums.append(spectrum)
- 
+parser.add_argument(
+    '--no-cache',
+    help='Always parse the mgf files instead of using or writing the binary spectrum cache next to them',
+    action='store_true'
+)
 
-    scores = calculate_scores(references=spectrums,
-                          queries=spectrums,
-                          similarity_function=ModifiedCosine(tolerance=args.fragment_tolerance))
+parser.add_argument(
+    '--score-cache',
+    help='SQLite file of saved pair scores; pairs already scored with the same scoring settings are not scored again, whatever the score and peaks thresholds'
+)
 
+parser.add_argument(
+    '--edge-file',
+    help='Write the spectrum matches that pass the score and peaks thresholds to this binary file as they are calculated, instead of keeping them in memory'
+)
 
-    spectra_matches=convert.convert_scores(scores)
-    spectra_list=[]
-    for s in spectrums:
-        new = convert.convert_spectrum(s)
-        spectra_list.append(new)
+parser.add_argument(
+    '--format',
+    help='Output format: GraphML, Cytoscape JSON (\'.json\'), or CSV node and edge tables (\'_nodes.csv\' and \'_edges.csv\')',
+    choices=['graphml','cytoscape','csv'],
+    default='graphml'
+)
 
+parser.add_argument(
+    '--gzip',
+    help='Compress the output files with gzip, adding \'.gz\' to their names',
+    action='store_true'
+)
 
+parser.add_argument(
+    '--ms1',
+    help='''Do t-test on MS1 data. Requires a .csv file of peak area in each sample for each spectrum 
+    and a .csv file with columns "sample" and "group"''',
+    nargs=2
     
+)
 
-else:
-    from msmolnet import read_mgf as mgf
-
-    input_mgf=f'{args.input}.mgf'
-    print(f"reading file {input_mgf}")
-    spectra_list=mgf.read_mgf(input_mgf)
-
-    if (args.library):
-        library_file=f'{args.library}.mgf'
-        print("comparing to library")
-        similarity.library_match(spectra_list,library_file,precursor_tol=args.lib_precursor_tolerance,cosine=args.library_score,n_peaks=args.library_peaks)
-
-    #calculate modified cosines, comparing each spectrum to every other spectrum
-    print("calculating cosine scores")
-    spectra_matches=similarity.compare_all(spectra_list,fragment_tolerance=args.fragment_tolerance,modified=args.modified,precursor_tolerance=args.modification_mass,greedy=args.greedy)
-
-
-if (args.ms1):
-    from msmolnet import ms1_analysis
-    ms1_analysis.samples_ttest(args.ms1[0],args.ms1[1],spectra_list)
-
-#filter matches
-print("filtering spectrum matches")
-spectra_matches=similarity.filter_pairs(
-    spectra_matches,
-    cosine_threshold=args.score,
-    peak_threshold=args.peaks)
-
-
-from msmolnet import network    
-
-print("making graph")
-graph=network.make_network(spectra_list,spectra_matches)
-        
-print("filtering neighbours")
-graph=network.filter_neighbors(graph,args.n_neighbours)
+parser.add_argument(
+    '--ms1-results',
+    help='Write the t-test result of every MS1 feature to this .csv file'
+)
 
-print("filtering family size")
-graph=network.filter_family(graph,args.family_size)
 
-output_file=f'{args.output}.graphml'
-network.write_graphml(graph, output_file)
-print(f"written to {output_file}")
+def main():
+    args = parser.parse_args()
+    print(args)
+
+    if (args.matchms):
+        print('use matchms')
+        import matchms
+        from matchms.importing import load_from_mgf
+        from matchms.filtering import default_filters
+        from matchms.filtering import normalize_intensities
+        from matchms.filtering import add_precursor_mz
+        from matchms import calculate_scores
+        from matchms.similarity import ModifiedCosine
+        from msmolnet.use_matchms import convert_matches as convert
+
+        input_mgf=f'{args.input}.mgf'
+        print(f"reading file {input_mgf}")
+        file=load_from_mgf(input_mgf)
+        print(file)
+
+        print("normalising intensities")
+
+        # Apply filters to clean and enhance each spectrum
+        spectrums = []
+        for spectrum in file:
+            spectrum = default_filters(spectrum)
+            # Scale peak intensities to maximum of 1
+            spectrum = normalize_intensities(spectrum)
+            print(spectrum.get('precursor_mz'))
+            spectrums.append(spectrum)
+
+
+        scores = calculate_scores(references=spectrums,
+                              queries=spectrums,
+                              similarity_function=ModifiedCosine(tolerance=args.fragment_tolerance))
+
+
+        spectra_list=[]
+        for s in spectrums:
+            new = convert.convert_spectrum(s)
+            spectra_list.append(new)
+        #matches are keyed by scans number, the network needs the spectra
+        spectra_matches=convert.match_spectra(convert.convert_scores(scores),spectra_list)
+
+
+
+
+    else:
+        from msmolnet import read_mgf as mgf
+
+        input_mgf=f'{args.input}.mgf'
+        print(f"reading file {input_mgf}")
+        spectra_list=mgf.read_mgf(input_mgf,cache=not args.no_cache,workers=args.jobs)
+
+        if (args.library):
+            library_file=f'{args.library}.mgf'
+            print("comparing to library")
+            similarity.library_match(spectra_list,library_file,precursor_tol=args.lib_precursor_tolerance,cosine=args.library_score,n_peaks=args.library_peaks,cache=not args.no_cache,
+                top_k=args.library_top_k,workers=args.jobs,analog=args.analog,max_mass_difference=args.modification_mass,
+                shard_size=args.library_shard_size)
+
+        pairs=None
+        if (args.approximate):
+            from msmolnet.NeighbourIndex import NeighbourIndex
+            print("finding candidate neighbours")
+            index=NeighbourIndex(spectra_list,fragment_tolerance=args.fragment_tolerance,precursor_tolerance=args.modification_mass)
+            pairs=index.candidate_pairs(args.n_neighbours)
+
+        if (args.score_cache):
+            from msmolnet.ScoreCache import ScoreCache
+            cache_context=ScoreCache(args.score_cache)
+        else:
+            from contextlib import nullcontext
+            cache_context=nullcontext()
+
+        #calculate modified cosines, comparing each spectrum to every other spectrum
+        print("calculating cosine scores")
+        #the score cache is closed even if scoring fails
+        with cache_context as score_cache:
+            options=dict(fragment_tolerance=args.fragment_tolerance,modified=args.modified,precursor_tolerance=args.modification_mass,greedy=args.greedy,workers=args.jobs,
+                cosine_threshold=args.score,peak_threshold=args.peaks,prefilter=args.prefilter,pairs=pairs,score_cache=score_cache)
+            if (args.edge_file):
+                from msmolnet.EdgeTable import EdgeTable
+                n_matches=similarity.write_matches(args.edge_file,spectra_list,**options)
+                print(f"{n_matches} matches written to {args.edge_file}")
+                spectra_matches=EdgeTable.from_file(spectra_list,args.edge_file)
+            else:
+                spectra_matches=similarity.compare_all(spectra_list,as_table=True,**options)
+
+
+    if (args.ms1):
+        from msmolnet import ms1_analysis
+        ms1_analysis.samples_ttest(args.ms1[0],args.ms1[1],spectra_list,results_file=args.ms1_results)
+
+    #filter matches
+    print("filtering spectrum matches")
+    spectra_matches=similarity.filter_pairs(
+        spectra_matches,
+        cosine_threshold=args.score,
+        peak_threshold=args.peaks)
+
+
+    from msmolnet import write_network
+    from msmolnet.SpectralNetwork import SpectralNetwork
+
+    print("making graph")
+    molecular_network=SpectralNetwork(spectra_list,spectra_matches)
+
+    print("filtering neighbours")
+    molecular_network=molecular_network.filter_neighbors(args.n_neighbours)
+
+    print("filtering family size")
+    molecular_network=molecular_network.filter_family(args.family_size)
+
+    suffix='.gz' if args.gzip else ''
+    if (args.format=='cytoscape'):
+        output_file=f'{args.output}.json{suffix}'
+        write_network.write_cytoscape(output_file,molecular_network)
+    elif (args.format=='csv'):
+        output_file=f'{args.output}_nodes.csv{suffix}'
+        write_network.write_tables(output_file,f'{args.output}_edges.csv{suffix}',molecular_network)
+    else:
+        output_file=f'{args.output}.graphml{suffix}'
+        write_network.write_graphml(output_file,molecular_network)
+    print(f"written to {output_file}")
+
+
+if __name__ == '__main__':
+    main()
 
 # #print time of program running
 # elapsed = time.time()-start